@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# A small on-disk cache for responses.  Each entry is stored in its own file,
+# named after a hash of the key, and sharded into sub-folders so no single
+# folder gets too large.  An index of every entry is kept in memory for
+# quick lookups, and saved to disk so it doesn't need to be rebuilt each
+# run.  The index is only written out in full by flush(), at exit, in
+# between, each entry added or removed is appended to a journal, which is
+# played back on top of the index when it's loaded, so the work for each
+# change doesn't grow with the size of the cache.  Entries are evicted,
+# least recently used first, when the cache goes over its size or entry
+# limits, or when they get too old
+
+import hashlib, json, os, tempfile, threading, time
+
+INDEX_NAME = "index.json"
+JOURNAL_NAME = "journal.jsonl"
+# Bump this if the layout of the cache changes, older caches are discarded
+INDEX_VERSION = 1
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_AGE = 90 * 24 * 60 * 60
+
+
+def key_hash(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def atomic_write(filename, data):
+    # Write to a temp file, and move it into place, so a reader never sees
+    # a half written file, even if we're interrupted
+    dirname = os.path.dirname(filename)
+    fd, temp = tempfile.mkstemp(dir=dirname, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, filename)
+    except:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+class ResponseCache:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # hash -> [key, size, created, last_used], kept in least recently used order
+        self._index = {}
+        self._total_bytes = 0
+        self._dirty = 0
+        self._journal = None
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _entry_filename(self, digest):
+        return os.path.join(self.root, digest[:2], digest + ".json")
+
+    def _load_index(self):
+        fn = os.path.join(self.root, INDEX_NAME)
+        index = None
+        if os.path.isfile(fn):
+            try:
+                with open(fn, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    index = data["entries"]
+            except (OSError, ValueError, KeyError):
+                index = None
+
+        if index is None:
+            index = self._rebuild_index()
+        else:
+            self._replay_journal(index)
+            self._remove_orphans(index)
+
+        # Python dicts keep insertion order, so sorting here gives us the
+        # least recently used order we'll maintain from here on
+        for digest, entry in sorted(index.items(), key=lambda x: x[1][3]):
+            self._index[digest] = entry
+            self._total_bytes += entry[1]
+
+        if self._dirty > 0:
+            # Start over with a full index, and an empty journal
+            self._save_index()
+
+    def _replay_journal(self, index):
+        # Apply the changes made since the index was last saved.  A line
+        # that was only partly written when we were interrupted is ignored
+        fn = os.path.join(self.root, JOURNAL_NAME)
+        try:
+            with open(fn, "rt", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                change = json.loads(line)
+            except ValueError:
+                continue
+            if change[0] == "put":
+                index[change[1]] = change[2]
+            elif change[0] == "remove":
+                index.pop(change[1], None)
+            self._dirty += 1
+
+    def _entry_files(self):
+        # Every entry file on disk, as (digest, filename), removing any temp
+        # files left behind by an interrupted write along the way
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for cur in os.listdir(shard_dir):
+                fn = os.path.join(shard_dir, cur)
+                if cur.startswith(".tmp_"):
+                    os.unlink(fn)
+                    continue
+                yield cur[:-5], fn
+
+    def _remove_orphans(self, index):
+        # Entry files the index doesn't know about, say because we were
+        # interrupted between writing one and noting it in the journal,
+        # would never count against the limits or be evicted
+        for digest, fn in self._entry_files():
+            if digest not in index:
+                try:
+                    os.unlink(fn)
+                except OSError:
+                    pass
+
+    def _rebuild_index(self):
+        # The index is missing or unreadable, so recover what we can from
+        # the entries on disk
+        index = {}
+        for digest, fn in self._entry_files():
+            try:
+                with open(fn, "rt", encoding="utf-8") as f:
+                    key = json.load(f)["key"]
+                stat = os.stat(fn)
+            except (OSError, ValueError, KeyError):
+                continue
+            index[digest] = [key, stat.st_size, stat.st_mtime, stat.st_mtime]
+        self._dirty = 1
+        return index
+
+    def _save_index(self):
+        # Write out the whole index, everything in the journal is in it now
+        data = json.dumps({"version": INDEX_VERSION, "entries": self._index})
+        atomic_write(os.path.join(self.root, INDEX_NAME), data.encode("utf-8"))
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        try:
+            os.unlink(os.path.join(self.root, JOURNAL_NAME))
+        except OSError:
+            pass
+        self._dirty = 0
+
+    def _note_change(self, change):
+        # Add a change to the journal, it's flushed right away, so it's
+        # there even if we're stopped before the index is saved
+        if self._journal is None:
+            self._journal = open(os.path.join(self.root, JOURNAL_NAME), "at", encoding="utf-8")
+        self._journal.write(json.dumps(change) + "\n")
+        self._journal.flush()
+        self._dirty += 1
+
+    def _remove(self, digest):
+        entry = self._index.pop(digest)
+        self._total_bytes -= entry[1]
+        self._note_change(["remove", digest])
+        try:
+            os.unlink(self._entry_filename(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Toss out the least recently used entries till we're under the limits,
+        # along with any old ones we come across along the way.  Old entries
+        # further along are caught when they're next looked up
+        now = time.time()
+        while len(self._index) > 0:
+            digest = next(iter(self._index))
+            over = len(self._index) > self.max_entries or self._total_bytes > self.max_bytes
+            expired = self.max_age is not None and now - self._index[digest][2] > self.max_age
+            if not over and not expired:
+                break
+            self._remove(digest)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        digest = key_hash(key)
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is not None and self.max_age is not None and time.time() - entry[2] > self.max_age:
+                self._remove(digest)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            try:
+                with open(self._entry_filename(digest), "rt", encoding="utf-8") as f:
+                    value = json.load(f)["value"]
+            except (OSError, ValueError, KeyError):
+                # Someone removed or damaged the file out from under us
+                self._remove(digest)
+                self.misses += 1
+                return default
+            # Move this to the most recently used end of the index, this
+            # isn't worth a journal entry, it's saved along with the index
+            entry[3] = time.time()
+            self._index[digest] = self._index.pop(digest)
+            self._dirty += 1
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        digest = key_hash(key)
+        data = json.dumps({"key": key, "value": value}).encode("utf-8")
+        with self._lock:
+            fn = self._entry_filename(digest)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            atomic_write(fn, data)
+            if digest in self._index:
+                self._total_bytes -= self._index.pop(digest)[1]
+            now = time.time()
+            self._index[digest] = [key, len(data), now, now]
+            self._total_bytes += len(data)
+            self._note_change(["put", digest, self._index[digest]])
+            self._evict()
+
+    def __contains__(self, key):
+        return key_hash(key) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self):
+        return {
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def flush(self):
+        with self._lock:
+            if self._dirty > 0:
+                self._save_index()
+
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly")
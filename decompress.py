@@ -2,183 +2,168 @@
 
 # Fairly straight port of
 # https://github.com/pieroxy/lz-string/
-# to Python.  Only decompress was ported
+# to Python.  Only decompress was ported, test_decompress.py has the
+# original, more literal, port to test against
 
 import re
 
 
-def decompress(compressed):
-    if (compressed is None) or (compressed == ''):
-        return ''
-
-    dictionary = {}
-    enlargeIn = 4
-    dictSize = 4
-    numBits = 3
-    (entry, result, w, c) = ('', '', '', '')
-    (i, nnext, bits, resb, maxpower, power) = (0, 0, 0, 0, 0, 0)
-
-    data_string = compressed
-    data_val = ord(compressed[0])
-    data_position = 32768
-    data_index = 1
-
-    for i in range(3):
-        dictionary[i] = ''
-
-    bits = 0
-    maxpower = pow(2, 2)
-    power = 1
+def _build_rev16():
+    rev8 = [int(f"{x:08b}"[::-1], 2) for x in range(256)]
+    return [(rev8[x & 0xff] << 8) | rev8[x >> 8] for x in range(65536)]
 
-    while power != maxpower:
-        resb = data_val & data_position
-        data_position >>= 1
+# REV16[x] is x with the order of its 16 bits reversed
+REV16 = _build_rev16()
 
-        if data_position == 0:
-            data_position = 32768
-            data_val = ord(data_string[data_index])
-            data_index += 1
 
-        bits |= (1 if resb > 0 else 0) * power
-        power <<= 1
+def decompress(compressed):
+    if (compressed is None) or (compressed == ''):
+        return ''
 
-    nnext = bits
+    # Each character holds 16 bits, read starting from the high bit, but each
+    # code is built up starting from its low bit.  So each character is
+    # reversed as it's loaded into the accumulator, and then every code can
+    # be taken straight off the bottom of it, all of its bits at once
+    data = compressed
+    data_len = len(data)
+    rev16 = REV16
+    acc = 0
+    acc_bits = 0
+    index = 0
+
+    def read_bits(count):
+        nonlocal acc, acc_bits, index
+        while acc_bits < count:
+            acc |= rev16[ord(data[index])] << acc_bits
+            index += 1
+            acc_bits += 16
+        bits = acc & ((1 << count) - 1)
+        acc >>= count
+        acc_bits -= count
+        if acc_bits == 0 and index == data_len:
+            # The original port reads the next character as soon as the last
+            # one is used up, so running out of data is always an error
+            raise IndexError("string index out of range")
+        return bits
+
+    nnext = read_bits(2)
     if nnext == 0:
-        bits = 0
-        maxpower = pow(2, 8)
-        power = 1
-
-        while power != maxpower:
-            resb = data_val & data_position
-            data_position >>= 1
-
-            if data_position == 0:
-                data_position = 32768
-                data_val = ord(data_string[data_index])
-                data_index += 1
-
-            bits |= (1 if resb > 0 else 0) * power
-            power <<= 1
-
-        c = chr(bits)
+        c = chr(read_bits(8))
     elif nnext == 1:
-        bits = 0
-        maxpower = pow(2, 16)
-        power = 1
-
-        while power != maxpower:
-            resb = data_val & data_position
-            data_position >>= 1
-
-            if data_position == 0:
-                data_position = 32768
-                data_val = ord(data_string[data_index])
-                data_index += 1
-
-            bits |= (1 if resb > 0 else 0) * power
-            power <<= 1
-
-        c = chr(bits)
+        c = chr(read_bits(16))
     elif nnext == 2:
         return ''
+    else:
+        c = ''
 
-    dictionary[3] = c
-    result = c
-    w = result
+    dictionary = ['', '', '', c]
+    result = [c]
+    w = c
+    enlarge_in = 4
+    num_bits = 3
+    mask = (1 << num_bits) - 1
 
     while True:
-        if data_index > len(data_string):
-            return ''
-
-        bits = 0
-        maxpower = pow(2, numBits)
-        power = 1
-
-        while power != maxpower:
-            resb = data_val & data_position
-            data_position >>= 1
-
-            if data_position == 0:
-                data_position = 32768
-                data_val = ord(data_string[data_index])
-                data_index += 1
-
-            bits |= (1 if resb > 0 else 0) * power
-            power <<= 1
-
-        c = bits
+        # Read the next code, this is read_bits inlined, since it's the hot path
+        while acc_bits < num_bits:
+            acc |= rev16[ord(data[index])] << acc_bits
+            index += 1
+            acc_bits += 16
+        c = acc & mask
+        acc >>= num_bits
+        acc_bits -= num_bits
+        if acc_bits == 0 and index == data_len:
+            raise IndexError("string index out of range")
 
         if c == 0:
-            bits = 0
-            maxpower = pow(2, 8)
-            power = 1
-
-            while power != maxpower:
-                resb = data_val & data_position
-                data_position >>= 1
-
-                if data_position == 0:
-                    data_position = 32768
-                    data_val = ord(data_string[data_index])
-                    data_index += 1
-
-                bits |= (1 if resb > 0 else 0) * power
-                power <<= 1
-
-            dictionary[dictSize] = chr(bits)
-            dictSize += 1
-            c = dictSize - 1
-            enlargeIn -= 1
+            dictionary.append(chr(read_bits(8)))
+            c = len(dictionary) - 1
+            enlarge_in -= 1
         elif c == 1:
-            bits = 0
-            maxpower = pow(2, 16)
-            power = 1
-
-            while power != maxpower:
-                resb = data_val & data_position
-                data_position >>= 1
-
-                if data_position == 0:
-                    data_position = 32768
-                    data_val = ord(data_string[data_index])
-                    data_index += 1
-
-                bits |= (1 if resb > 0 else 0) * power
-                power <<= 1
-
-            dictionary[dictSize] = chr(bits)
-            dictSize += 1
-            c = dictSize - 1
-            enlargeIn -= 1
+            dictionary.append(chr(read_bits(16)))
+            c = len(dictionary) - 1
+            enlarge_in -= 1
         elif c == 2:
-            return result
+            return ''.join(result)
 
-        if enlargeIn == 0:
-            enlargeIn = pow(2, numBits)
-            numBits += 1
+        if enlarge_in == 0:
+            enlarge_in = 1 << num_bits
+            num_bits += 1
+            mask = (1 << num_bits) - 1
 
-        if c in dictionary:
+        if c < len(dictionary):
             entry = dictionary[c]
+        elif c == len(dictionary):
+            entry = w + w[0]
         else:
-            if c == dictSize:
-                entry = w + w[0]
-            else:
-                return None
+            return None
+
+        result.append(entry)
+        dictionary.append(w + entry[0])
+        enlarge_in -= 1
+        w = entry
 
-        result += entry
+        if enlarge_in == 0:
+            enlarge_in = 1 << num_bits
+            num_bits += 1
+            mask = (1 << num_bits) - 1
 
-        dictionary[dictSize] = w + entry[0]
-        dictSize += 1
-        enlargeIn -= 1
 
-        w = entry
+def _build_hex2():
+    digits = "0123456789abcdefABCDEF"
+    return {a + b: chr(int(a + b, 16)) for a in digits for b in digits}
 
-        if enlargeIn == 0:
-            enlargeIn = pow(2, numBits)
-            numBits += 1
+# Every pair of hex digits, in any case, and the character it stands for
+HEX2 = _build_hex2()
 
 
 def decode(value):
+    # Undo the "%uXXXX" and "%XX" escapes in one pass, copying everything
+    # between them as is
+    parts = value.split("%")
+    if len(parts) == 1:
+        return value
+
+    hex2 = HEX2
+    try:
+        # The common case, where every escape is a "%XX" escape
+        return parts[0] + "".join([hex2[part[:2]] + part[2:] for part in parts[1:]])
+    except KeyError:
+        pass
+
+    ret = [parts[0]]
+    escapes = 0
+    has_u = False
+    for part in parts[1:]:
+        if part[:1] == "u":
+            high = hex2.get(part[1:3])
+            low = hex2.get(part[3:5])
+            if high is not None and low is not None:
+                ret.append(chr((ord(high) << 8) | ord(low)))
+                ret.append(part[5:])
+                escapes += 1
+                has_u = True
+                continue
+        else:
+            c = hex2.get(part[:2])
+            if c is not None:
+                ret.append(c)
+                ret.append(part[2:])
+                escapes += 1
+                continue
+        ret.append("%")
+        ret.append(part)
+
+    ret = "".join(ret)
+    if has_u and (escapes != len(parts) - 1 or "%" in ret):
+        # The original decoded all "%uXXXX" escapes, then all "%XX" escapes
+        # in the result.  That can only differ from doing both at once if a
+        # "%" is left over, so leave the odd cases to the original
+        return decode_two_pass(value)
+    return ret
+
+
+def decode_two_pass(value):
     value = re.sub("%u([0-9A-Fa-f]{4})", lambda m: chr(int(m.group(1), 16)), value)
     value = re.sub("%([0-9A-Fa-f]{2})", lambda m: chr(int(m.group(1), 16)), value)
     return value
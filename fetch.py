@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+
+# Shared HTTP plumbing for talking to the NY Times.  A single Client owns a
+# pooled, keep-alive requests.Session so a run only pays for the TCP+TLS
+# handshake once per host, instead of once per request.  requests is slow to
+# import, so it's only imported once something actually talks to a server
+
+import atexit, base64, contextlib, json, random, struct, threading, time, zlib
+
+# Number of connections to keep alive per host
+DEFAULT_POOL_SIZE = 10
+# Timeouts in seconds, as (connect, read)
+DEFAULT_TIMEOUT = (10, 60)
+# How much of a response to read at a time when streaming it
+DEFAULT_CHUNK_SIZE = 16384
+
+
+# The errors that can come out of a request, split up by what can be done about them
+class FetchError(Exception):
+    # Something went wrong, and trying again won't help
+    retryable = False
+
+    def __init__(self, message, url=None, status=None, retry_after=None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TransientError(FetchError):
+    # Server errors, dropped connections, and timeouts, likely to work later
+    retryable = True
+
+
+class ThrottledError(TransientError):
+    # The server asked us to slow down
+    pass
+
+
+class AuthError(FetchError):
+    # The cookies aren't valid, or the user isn't logged in
+    pass
+
+
+class NotFoundError(FetchError):
+    # There's nothing at this URL
+    pass
+
+
+class NoMatchError(FetchError):
+    # The page loaded, but it doesn't look like we expected, the
+    # layout of the page has probably changed
+    pass
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds, or a HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        import email.utils
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def check_response(resp, url):
+    # Turn a bad status code into the matching error
+    status = resp.status_code
+    if status < 400:
+        return
+    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+    message = f"HTTP {status} for {url}"
+    if status == 429:
+        raise ThrottledError(message, url, status, retry_after)
+    if status >= 500:
+        raise TransientError(message, url, status, retry_after)
+    if status in (401, 403):
+        raise AuthError(message, url, status)
+    if status == 404:
+        raise NotFoundError(message, url, status)
+    raise FetchError(message, url, status)
+
+
+class RetryPolicy:
+    # Decides if, and how long to wait before, trying a failed request
+    # again.  The delay grows exponentially, with some jitter so a group of
+    # workers don't all retry at once, and any Retry-After from the server wins
+    def __init__(self, attempts=5, base_delay=0.5, max_delay=30.0, max_retry_after=120.0, jitter=True):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.jitter = jitter
+
+    def should_retry(self, error, attempt):
+        return error.retryable and attempt + 1 < self.attempts
+
+    def delay(self, error, attempt):
+        if error.retry_after is not None:
+            return min(error.retry_after, self.max_retry_after)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if self.jitter:
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except FetchError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.delay(e, attempt))
+                attempt += 1
+
+
+class RateLimiter:
+    # Spaces out calls so no more than 'rate' happen per second, across
+    # every thread that shares this limiter.  A rate of None or 0 disables it
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if self.interval == 0.0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SessionTransport:
+    # Talks to the real server, over a pooled, keep-alive requests.Session
+    offline = False
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        import requests, requests.adapters
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def set_cookies(self, cookies):
+        import requests.utils
+        self.session.cookies = requests.utils.cookiejar_from_dict(cookies)
+
+    def cookie_jar(self):
+        return self.session.cookies
+
+    def get(self, url):
+        import requests
+        try:
+            resp = self.session.get(url, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientError(str(e), url) from e
+        check_response(resp, url)
+        return resp.content
+
+    @contextlib.contextmanager
+    def stream(self, url, chunk_size):
+        import requests
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+                check_response(resp, url)
+                yield resp.iter_content(chunk_size)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            raise TransientError(str(e), url) from e
+
+    def close(self):
+        self.session.close()
+
+
+class Client:
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, rate_limit=None, retry=None, transport=None, recorder=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.transport = transport if transport is not None else SessionTransport(pool_size, timeout)
+        # If set, every response is also written out to this recorder, unless
+        # a request is given a recorder of its own
+        self.recorder = recorder
+        self._cookies = None
+
+    @property
+    def offline(self):
+        # True if this client doesn't talk to a real server
+        return self.transport.offline
+
+    def set_cookies(self, cookies):
+        # Only build the cookie jar when we're handed a different set of
+        # cookies, the common case is the same dict for an entire run
+        if cookies is not self._cookies:
+            self.transport.set_cookies(cookies)
+            self._cookies = cookies
+            if self.recorder is not None:
+                self.recorder.record_cookies(cookies)
+
+    def cookie_jar(self):
+        return self.transport.cookie_jar()
+
+    def _get_once(self, url, recorder):
+        self.limiter.wait()
+        resp = self.transport.get(url)
+        if recorder is not None:
+            recorder.record(url, resp)
+        return resp
+
+    def get(self, url, recorder=None):
+        if recorder is None:
+            recorder = self.recorder
+        return self.retry.call(self._get_once, url, recorder)
+
+    def _stream_once(self, url, make_consumer, chunk_size, recorder):
+        consumer = make_consumer()
+        read = [] if recorder is not None else None
+        self.limiter.wait()
+        with self.transport.stream(url, chunk_size) as chunks:
+            for chunk in chunks:
+                if read is not None:
+                    read.append(chunk)
+                if consumer.feed(chunk):
+                    # The consumer has everything it needs, leaving the 'with'
+                    # drops the connection without reading the rest
+                    break
+            else:
+                consumer.feed(b"", final=True)
+        if read is not None:
+            recorder.record(url, b"".join(read))
+        return consumer
+
+    def stream(self, url, make_consumer, chunk_size=DEFAULT_CHUNK_SIZE, recorder=None):
+        # Feed a response to a consumer as it arrives, stopping early if the
+        # consumer's feed() returns True.  make_consumer is called to get
+        # a fresh consumer for each attempt, which is returned at the end
+        if recorder is None:
+            recorder = self.recorder
+        return self.retry.call(self._stream_once, url, make_consumer, chunk_size, recorder)
+
+    def close(self):
+        self.transport.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+# Recordings of responses, a sequence of records, each one:
+#   RECORD_FORMAT header: kind, size of the JSON header, size of the zlib compressed body
+#   A JSON header, with the URL or other details of the record
+#   The compressed body of the response
+# When the recording is closed, an index record with the offsets of each
+# URL's responses is added, followed by INDEX_TRAILER_FORMAT, which points
+# to the index record.  If the trailer is missing, say because a run was
+# interrupted, the records are read in order to rebuild the index.  A later
+# run adds its records after the earlier ones, with an index covering them all
+RECORDING_MAGIC = b"NYTXWREC\x01"
+RECORD_FORMAT = "<BII"
+INDEX_TRAILER_FORMAT = "<Q8s"
+INDEX_TRAILER_MAGIC = b"NYTXWIDX"
+RECORD_RESPONSE = 1
+RECORD_COOKIES = 2
+RECORD_NOTE = 3
+RECORD_INDEX = 4
+
+
+class Recorder:
+    # Writes out every response a client gets, along with the cookies used
+    # and any notes, to a file that can be replayed with ReplayTransport
+    def __init__(self, filename):
+        # An existing recording is added to, rather than started over, so
+        # each run's responses end up after the ones from earlier runs
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._cookies = None
+        self._file = open(filename, "a+b")
+        self._file.seek(0)
+        data = self._file.read()
+        if len(data) == 0:
+            self._index = {}
+            self._file.write(RECORDING_MAGIC)
+        elif data.startswith(RECORDING_MAGIC):
+            # Drop the old trailer, or a record that was only partly
+            # written, the new index covers the old responses too
+            self._index, end = read_index(data)
+            self._file.truncate(end)
+        else:
+            self._file.close()
+            raise ValueError(f"{filename} is not a recording, convert it with 'test_nyt.py convert_log', or move it")
+        self._file.seek(0, 2)
+        atexit.register(self.close)
+
+    def _write(self, kind, header, body=b""):
+        header = json.dumps(header).encode("utf-8")
+        body = zlib.compress(body)
+        with self._lock:
+            if self._file is None:
+                return None
+            offset = self._file.tell()
+            self._file.write(struct.pack(RECORD_FORMAT, kind, len(header), len(body)))
+            self._file.write(header)
+            self._file.write(body)
+            self._file.flush()
+            return offset
+
+    def record(self, url, body):
+        offset = self._write(RECORD_RESPONSE, {"url": url}, body)
+        if offset is not None:
+            with self._lock:
+                self._index.setdefault(url, []).append(offset)
+
+    def record_cookies(self, cookies):
+        # Only when they change, the common case is the same dict for an entire run
+        with self._lock:
+            if cookies is self._cookies:
+                return
+            self._cookies = cookies
+        self._write(RECORD_COOKIES, {"cookies": cookies})
+
+    def note(self, text):
+        self._write(RECORD_NOTE, {"note": text})
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            f, self._file = self._file, None
+        header = json.dumps({"index": self._index}).encode("utf-8")
+        offset = f.tell()
+        f.write(struct.pack(RECORD_FORMAT, RECORD_INDEX, len(header), 0))
+        f.write(header)
+        f.write(struct.pack(INDEX_TRAILER_FORMAT, offset, INDEX_TRAILER_MAGIC))
+        f.close()
+
+
+def read_record(data, offset):
+    # The kind, header, and where the body of the record at offset is
+    kind, header_len, body_len = struct.unpack_from(RECORD_FORMAT, data, offset)
+    offset += struct.calcsize(RECORD_FORMAT)
+    header = json.loads(data[offset:offset + header_len])
+    offset += header_len
+    return kind, header, offset, body_len
+
+
+def read_index(data):
+    # The index of a recording, URL -> offsets of its responses, and where
+    # its records end, before the index trailer, or before a record that
+    # was only partly written
+    trailer_size = struct.calcsize(INDEX_TRAILER_FORMAT)
+    if len(data) >= len(RECORDING_MAGIC) + trailer_size:
+        offset, magic = struct.unpack_from(INDEX_TRAILER_FORMAT, data, len(data) - trailer_size)
+        if magic == INDEX_TRAILER_MAGIC:
+            return read_record(data, offset)[1]["index"], len(data) - trailer_size
+
+    # No index, walk through all of the records
+    index = {}
+    offset = len(RECORDING_MAGIC)
+    while offset + struct.calcsize(RECORD_FORMAT) <= len(data):
+        kind, header_len, body_len = struct.unpack_from(RECORD_FORMAT, data, offset)
+        if offset + struct.calcsize(RECORD_FORMAT) + header_len + body_len > len(data):
+            # The last record was only partly written
+            break
+        kind, header, body_offset, body_len = read_record(data, offset)
+        if kind == RECORD_RESPONSE:
+            index.setdefault(header["url"], []).append(offset)
+        offset = body_offset + body_len
+    return index, offset
+
+
+def read_recording(filename):
+    # Load a recording into a dictionary of URL -> list of responses.  This
+    # understands both Recorder's files and the older text logs, with a line
+    # for each "URL", "COOKIES", and "RESPONSE"
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    ret = {}
+    if not data.startswith(RECORDING_MAGIC):
+        url = None
+        for line in data.decode("utf-8").splitlines():
+            if line.startswith("URL "):
+                url = line[4:]
+            elif line.startswith("RESPONSE ") and url is not None:
+                ret.setdefault(url, []).append(base64.b64decode(line[9:]))
+                url = None
+        return ret
+
+    index = read_index(data)[0]
+    for url, offsets in index.items():
+        for offset in offsets:
+            _kind, _header, body_offset, body_len = read_record(data, offset)
+            ret.setdefault(url, []).append(zlib.decompress(data[body_offset:body_offset + body_len]))
+    return ret
+
+
+class ReplayTransport:
+    # Serves responses from a recording instead of talking to a server.  If
+    # a URL was requested more than once, the responses are played back in
+    # order, with the last one repeating from then on
+    offline = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._responses = read_recording(filename)
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def set_cookies(self, cookies):
+        pass
+
+    def cookie_jar(self):
+        return {}
+
+    def get(self, url):
+        with self._lock:
+            responses = self._responses.get(url)
+            if responses is None:
+                raise NotFoundError(f"No recorded response for {url}", url, 404)
+            served = self._served.get(url, 0)
+            self._served[url] = served + 1
+        return responses[min(served, len(responses) - 1)]
+
+    @contextlib.contextmanager
+    def stream(self, url, chunk_size):
+        data = self.get(url)
+        yield (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+    def close(self):
+        pass
+
+
+_client = None
+def get_client():
+    # The default client, shared by everything in this process
+    global _client
+    if _client is None:
+        _client = Client()
+    return _client
+
+
+def set_client(client):
+    # Replace the default client, returns the old one
+    global _client
+    old, _client = _client, client
+    return old
+
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly")
@@ -1,12 +1,33 @@
 #!/usr/bin/env python3
 
 from datetime import datetime, timedelta
+import fetch
 import json
 import nyt
 import os
+import queue
 import sys
 import textwrap
-import time
+import threading
+import traceback
+
+# Where the calendar of puzzles lives, this can be pointed to a server from
+# local_server.py for testing, either here, or with the NYTXW_CALENDAR_URL
+# environment variable
+CALENDAR_BASE_URL = os.environ.get("NYTXW_CALENDAR_URL", "https://nyt-games-prd.appspot.com")
+
+# Tunables for the download pipeline, all of these can be changed from the
+# command line with an option like "--fetch-workers=8"
+OPTIONS = {
+    # Number of threads downloading puzzles at once
+    "fetch-workers": 4,
+    # Number of threads turning puzzle data into .puz files
+    "convert-workers": 2,
+    # Most requests per second to send to the website, across all workers
+    "rate": 1.0,
+    # How many puzzles can be waiting between each stage
+    "queue-size": 16,
+}
 
 def clean_date(val):
     if val == "now":
@@ -16,37 +37,151 @@ def clean_date(val):
     else:
         return val
 
+def parse_options(args):
+    # Pull out any "--name=value" options, returning the remaining arguments
+    options = dict(OPTIONS)
+    rest = []
+    for cur in args:
+        if cur.startswith("--") and "=" in cur:
+            key, value = cur[2:].split("=", 1)
+            if key not in options:
+                print(f"ERROR: Unknown option '{key}'")
+                exit(1)
+            options[key] = type(options[key])(value)
+        else:
+            rest.append(cur)
+    return options, rest
+
+# Each stage of the pipeline pulls work from one queue and pushes results to
+# the next, a None in a queue tells the workers there's nothing more coming
+def fetch_worker(jobs, to_convert, browser, client, context, failed):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        fn, puzzle_id = job
+        try:
+            data = nyt.call_with_cookies(browser, context.get_puzzle_from_id, puzzle_id, client)
+        except:
+            print(f"ERROR: Unable to download '{fn}'")
+            traceback.print_exc()
+            failed.append(fn)
+            continue
+        to_convert.put((fn, data))
+
+def convert_worker(to_convert, to_write, context, failed):
+    while True:
+        job = to_convert.get()
+        if job is None:
+            break
+        fn, data = job
+        try:
+            # Each puzzle gets its own context, so any warnings are
+            # recorded under its filename
+            data = context.copy(source=fn).data_to_puz(data).tobytes()
+        except:
+            print(f"ERROR: Unable to convert '{fn}'")
+            traceback.print_exc()
+            failed.append(fn)
+            continue
+        to_write.put((fn, data))
+
+def write_worker(to_write, failed):
+    while True:
+        job = to_write.get()
+        if job is None:
+            break
+        fn, data = job
+        try:
+            with open(fn, "wb") as f:
+                f.write(data)
+        except:
+            # Keep going, the converters are waiting on this queue
+            print(f"ERROR: Unable to write '{fn}'")
+            traceback.print_exc()
+            failed.append(fn)
+            continue
+        print(f"Created '{fn}'")
+
+def start_workers(count, target, *args):
+    ret = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+    for cur in ret:
+        cur.start()
+    return ret
+
+def stop_workers(workers, work_queue):
+    for _ in workers:
+        work_queue.put(None)
+    for cur in workers:
+        cur.join()
+
 def main():
-    if len(sys.argv) != 5:
+    options, args = parse_options(sys.argv[1:])
+    if len(args) != 4:
         print(textwrap.dedent(f"""
             Usage:
-                {os.path.split(__file__)[-1]} [browser] [start date] [end date] [dest folder]
+                {os.path.split(__file__)[-1]} [browser] [start date] [end date] [dest folder] <options>
 
             Will download all puzzles from start to end date, inclusive, skipping over
             any files that already exist.  Can use "now" for today's date, otherwise they
             must be formatted in yyyy-mm-dd
+
+            Options:
         """))
+        for key, value in OPTIONS.items():
+            print(f"    --{key}={value}")
+        print("")
         exit(1)
 
-    # Crack command line options    
-    browser = sys.argv[1]
+    # Crack command line options
+    browser = args[0]
     if browser not in nyt.get_browsers():
         print(f"ERROR: Unknown browser '{browser}', please select one of:")
         for key in nyt.get_browsers():
             print(f"  {key}")
         exit(1)
-    start, end = clean_date(sys.argv[2]), clean_date(sys.argv[3])
-    dest_folder = sys.argv[4]
+    start, end = clean_date(args[1]), clean_date(args[2])
+    dest_folder = args[3]
     if not os.path.isdir(dest_folder):
         print(f"{dest_folder} does not exist!")
 
+    download_range(browser, start, end, dest_folder, options)
+
+def download_range(browser, start, end, dest_folder, options=OPTIONS, context=None):
+    # The browser's cookies are loaded once, and shared by every worker, a
+    # browser of None sends no cookies, as when talking to a local server.
+    # So are the conversion settings, in context, which default to nyt's globals
+    if context is None:
+        context = nyt.default_context()
+
     # The endpoint that the NYTimes website uses for it's calendar
-    api = "https://nyt-games-prd.appspot.com/svc/crosswords/v3/51312474/puzzles.json?publish_type=daily&sort_order=asc&sort_by=print_date&date_start=START&date_end=END"
+    api = CALENDAR_BASE_URL + "/svc/crosswords/v3/51312474/puzzles.json?publish_type=daily&sort_order=asc&sort_by=print_date&date_start=START&date_end=END"
     api = api.replace("START", start).replace("END", end)
 
-    # Call into the helper here to load the endpoint
-    cookies = nyt.load_cookies(browser)
-    data = json.loads(nyt.get_url(cookies, api))
+    # One client for the whole run, so every puzzle reuses the same connections,
+    # and the rate limit is shared by every worker.  Don't want to torture the website
+    client = fetch.Client(
+        pool_size=max(fetch.DEFAULT_POOL_SIZE, options["fetch-workers"]),
+        rate_limit=options["rate"],
+    )
+    try:
+        return run_pipeline(browser, api, dest_folder, options, client, context)
+    finally:
+        client.close()
+
+def run_pipeline(browser, api, dest_folder, options, client, context):
+    # Download every puzzle in the calendar from api, and write them out,
+    # returns the files that couldn't be created
+    data = json.loads(nyt.call_with_cookies(browser, context.get_url, api, client))
+
+    # Start up the pipeline: download -> convert -> write out
+    failed = []
+    jobs = queue.Queue(options["queue-size"])
+    to_convert = queue.Queue(options["queue-size"])
+    to_write = queue.Queue(options["queue-size"])
+    fetchers = start_workers(options["fetch-workers"], fetch_worker, jobs, to_convert, browser, client, context, failed)
+    converters = start_workers(options["convert-workers"], convert_worker, to_convert, to_write, context, failed)
+    writers = start_workers(1, write_worker, to_write, failed)
 
     # Run through each puzzle
     for cur in data["results"]:
@@ -55,17 +190,22 @@ def main():
             x = cur["print_date"]
             fn = os.path.join(dest_folder, x + ".puz")
             if not os.path.isfile(fn):
-                # It's a new puzzle, grab it, conver it to a .puz file, and save it out
-                data = nyt.get_puzzle_from_id(cookies, cur["puzzle_id"])
-                puz = nyt.data_to_puz(data)
-                puz.save(fn)
-                print(f"Created '{fn}'")
-                # Don't want to torture the website
-                time.sleep(1.0)
+                # It's a new puzzle, hand it off to grab it, convert it to a .puz file, and save it out
+                jobs.put((fn, cur["puzzle_id"]))
             else:
                 print(f"'{fn}' already exists.")
 
+    # Let each stage finish in turn
+    stop_workers(fetchers, jobs)
+    stop_workers(converters, to_convert)
+    stop_workers(writers, to_write)
+
+    if len(failed) > 0:
+        print(f"Unable to create {len(failed)} puzzle(s):")
+        for fn in sorted(failed):
+            print(f"  '{fn}'")
     print("All done.")
+    return failed
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# A stand-in for the parts of the NY Times website this tool uses, for
+# testing downloads without touching the real site.  It serves:
+#   /crosswords/game/<kind>/YYYY/MM/DD          A game page with window.gameData
+#   /svc/crosswords/v6/puzzle/<kind>/YYYY-MM-DD.json   The puzzle for a date
+#   /svc/crosswords/v6/puzzle/<id>.json          The puzzle by ID
+#   /svc/crosswords/v3/<any>/puzzles.json        The calendar of puzzles
+# The puzzles are made up, unless a folder of v6 puzzle JSON files, named
+# "YYYY-MM-DD.json", is given.  It can also add latency, fail some requests,
+# and rate limit requests, to see how the downloader copes.
+#
+# To point the downloader at this server, set these environment variables:
+#   NYTXW_BASE_URL=http://127.0.0.1:8080
+#   NYTXW_CALENDAR_URL=http://127.0.0.1:8080
+
+from datetime import date, timedelta
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+OPTIONS = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    # Seconds to wait before each response, plus up to "jitter" more
+    "latency": 0.0,
+    "jitter": 0.0,
+    # Fraction of requests that fail with a 500 or 503
+    "error-rate": 0.0,
+    # Requests per second allowed before responding with a 429, 0 for no limit
+    "rate-limit": 0.0,
+    # Extra kilobytes of filler in each game page, the real ones are large
+    "page-kb": 256,
+    # A folder of puzzle JSON files to serve instead of made up ones
+    "archive": "",
+}
+
+# Puzzle IDs are just the number of days since this date
+FIRST_DATE = date(1942, 2, 15)
+PAGE_RE = re.compile("^/crosswords/game/(?P<kind>[a-z]+)/(?P<y>[0-9]{4})/(?P<m>[0-9]{2})/(?P<d>[0-9]{2})/?$")
+PUZZLE_DATE_RE = re.compile("^/svc/crosswords/v6/puzzle/(?P<kind>[a-z]+)/(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})\\.json$")
+PUZZLE_ID_RE = re.compile("^/svc/crosswords/v6/puzzle/(?P<id>[0-9]+)\\.json$")
+CALENDAR_RE = re.compile("^/svc/crosswords/v3/[^/]+/puzzles\\.json$")
+
+
+def date_to_id(when):
+    return (when - FIRST_DATE).days
+
+
+def id_to_date(puzzle_id):
+    return FIRST_DATE + timedelta(days=puzzle_id)
+
+
+def make_puzzle(when, size=15):
+    # Make up a puzzle for a date, the same date always gives the same puzzle
+    rng = random.Random(when.toordinal())
+    width = height = size
+    blocks = set()
+    while len(blocks) < width * height // 7:
+        x, y = rng.randrange(width), rng.randrange(height)
+        # Keep the grid symmetric, like a real one
+        blocks.add((x, y))
+        blocks.add((width - 1 - x, height - 1 - y))
+
+    def is_open(x, y):
+        return 0 <= x < width and 0 <= y < height and (x, y) not in blocks
+
+    # Number the grid, across clues first, then down clues, like the NY Times
+    across, down, labels = [], [], {}
+    for y in range(height):
+        for x in range(width):
+            if not is_open(x, y):
+                continue
+            starts_across = not is_open(x - 1, y) and is_open(x + 1, y)
+            starts_down = not is_open(x, y - 1) and is_open(x, y + 1)
+            if starts_across or starts_down:
+                labels[(x, y)] = str(len(labels) + 1)
+            if starts_across:
+                across.append((x, y))
+            if starts_down:
+                down.append((x, y))
+
+    clues = []
+    cell_clues = {}
+    for direction, starts, dx, dy in (("Across", across, 1, 0), ("Down", down, 0, 1)):
+        for x, y in starts:
+            clue_id = len(clues)
+            cells = []
+            while is_open(x, y):
+                cell_clues.setdefault((x, y), []).append(clue_id)
+                cells.append(y * width + x)
+                x, y = x + dx, y + dy
+            clues.append({
+                "cells": cells,
+                "direction": direction,
+                "label": labels[(cells[0] % width, cells[0] // width)],
+                "text": [{"plain": f"Made up clue for {len(cells)} letters"}],
+            })
+
+    cells = []
+    for y in range(height):
+        for x in range(width):
+            if is_open(x, y):
+                cell = {"answer": chr(ord("A") + rng.randrange(26)), "clues": cell_clues.get((x, y), []), "type": 1}
+                if (x, y) in labels:
+                    cell["label"] = labels[(x, y)]
+                cells.append(cell)
+            else:
+                cells.append({})
+
+    return {
+        "id": date_to_id(when),
+        "publicationDate": when.strftime("%Y-%m-%d"),
+        "constructors": ["Local Server"],
+        "editor": "Nobody",
+        "copyright": str(when.year),
+        "body": [{
+            "dimensions": {"width": width, "height": height},
+            "cells": cells,
+            "clues": clues,
+        }],
+    }
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, options):
+        super().__init__((options["host"], options["port"]), Handler)
+        self.options = options
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._next_slot = 0.0
+
+    def count(self, status):
+        with self._lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def pick_failure(self):
+        # Returns the status code to fail this request with, or None
+        with self._lock:
+            rate = self.options["rate-limit"]
+            if rate > 0:
+                now = time.monotonic()
+                if now < self._next_slot:
+                    return 429
+                self._next_slot = max(now, self._next_slot) + 1.0 / rate
+            if self._rng.random() < self.options["error-rate"]:
+                return self._rng.choice([500, 503])
+        return None
+
+    def load_puzzle(self, when):
+        if len(self.options["archive"]) > 0:
+            fn = os.path.join(self.options["archive"], when.strftime("%Y-%m-%d") + ".json")
+            if not os.path.isfile(fn):
+                return None
+            with open(fn, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        return make_puzzle(when)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body=b"", content_type="application/json", headers={}):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_json(self, data):
+        if data is None:
+            self.respond(404)
+        else:
+            self.respond(200, json.dumps(data).encode("utf-8"))
+
+    def do_GET(self):
+        options = self.server.options
+        if options["latency"] > 0 or options["jitter"] > 0:
+            time.sleep(options["latency"] + random.uniform(0, options["jitter"]))
+
+        status = self.server.pick_failure()
+        if status is not None:
+            self.respond(status, headers={"Retry-After": "1"} if status in (429, 503) else {})
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            m = PAGE_RE.match(url.path)
+            if m is not None:
+                self.send_page(m.group("kind") + "/" + "-".join(m.group("y", "m", "d")))
+                return
+
+            m = PUZZLE_DATE_RE.match(url.path)
+            if m is not None:
+                self.respond_json(self.server.load_puzzle(date.fromisoformat(m.group("date"))))
+                return
+
+            m = PUZZLE_ID_RE.match(url.path)
+            if m is not None:
+                self.respond_json(self.server.load_puzzle(id_to_date(int(m.group("id")))))
+                return
+
+            if CALENDAR_RE.match(url.path):
+                start = date.fromisoformat(query["date_start"][0])
+                end = date.fromisoformat(query["date_end"][0])
+                results = []
+                while start <= end:
+                    results.append({
+                        "puzzle_id": date_to_id(start),
+                        "print_date": start.strftime("%Y-%m-%d"),
+                        "format_type": "Normal",
+                    })
+                    start += timedelta(days=1)
+                self.respond_json({"status": "OK", "results": results})
+                return
+        except (KeyError, ValueError):
+            self.respond(400)
+            return
+
+        self.respond(404)
+
+    def send_page(self, key):
+        # Like the real thing, the game data is near the top of a large page
+        filler = ("<div>" + "x" * 90 + "</div>\n") * (self.server.options["page-kb"] * 10)
+        page = (
+            "<!DOCTYPE html>\n<html>\n<head><title>Crossword</title></head>\n<body>\n"
+            "<script>window.gameData = " + json.dumps({"filename": key}) + "</script>\n"
+            + filler + "</body>\n</html>\n"
+        )
+        self.respond(200, page.encode("utf-8"), "text/html; charset=utf-8")
+
+
+def start_server(options=OPTIONS):
+    # Start a server in the background, returns the server and its base URL
+    server = Server(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    options = dict(OPTIONS)
+    for cur in sys.argv[1:]:
+        key, _, value = cur[2:].partition("=")
+        if not cur.startswith("--") or key not in options:
+            print("Usage:")
+            print(f"  {os.path.split(__file__)[-1]} <options>")
+            print("")
+            print("Options:")
+            for key, value in OPTIONS.items():
+                print(f"  --{key}={value}")
+            exit(1)
+        options[key] = type(options[key])(value)
+
+    server = Server(options)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port}, press Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Responses sent:")
+    for status, count in sorted(server.stats.items()):
+        print(f"  {status}: {count:,}")
+
+
+if __name__ == "__main__":
+    main()
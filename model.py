@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# A compact model of a puzzle, built once from whatever format the NY Times
+# sent it in, the older "pluribus" game data, or the newer v6 puzzle JSON.
+# Everything after that, like nyt.data_to_puz, works from this, rather than
+# looking up keys in the raw data over and over.  There's no object per
+# square, the grid is kept as a few lists, one entry per square, since a
+# batch can hold thousands of puzzles.  The classes all use __slots__
+
+PUZZLE_FIELDS = ("width", "height", "answers", "more_answers", "cell_clues", "types", "indexes",
+                 "clues", "publication_date", "puzzle_id", "title", "constructors", "editor", "copyright", "notes")
+CELL_FIELDS = ("index", "answer", "more_answers", "clues", "type")
+CLUE_FIELDS = ("label", "direction", "text")
+
+
+class PuzzleModel:
+    # A whole puzzle.  Each square of the grid has an entry in each of:
+    #   answers       The answer, or None for a block
+    #   more_answers  None, unless the puzzle lists other answers, which some
+    #                 odd puzzles do even for squares without an answer
+    #   cell_clues    The clues the square is part of, as indexes into clues
+    #   types         The NY Times cell type, or None
+    #   indexes       Where the NY Times says the square is, normally its position
+    # Any of the other details the puzzle doesn't have are None, other than
+    # constructors and notes, which are empty lists
+    __slots__ = PUZZLE_FIELDS
+
+    def __init__(self, width, height, answers, more_answers, cell_clues, types, indexes, clues,
+                 publication_date=None, puzzle_id=None, title=None, constructors=(), editor=None, copyright=None,
+                 notes=()):
+        self.width = width
+        self.height = height
+        self.answers = answers
+        self.more_answers = more_answers
+        self.cell_clues = cell_clues
+        self.types = types
+        self.indexes = indexes
+        self.clues = clues
+        self.publication_date = publication_date
+        self.puzzle_id = puzzle_id
+        self.title = title
+        self.constructors = list(constructors)
+        self.editor = editor
+        self.copyright = copyright
+        self.notes = list(notes)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def cell(self, i):
+        # One square, as a Cell
+        return Cell(self.indexes[i], self.answers[i], self.more_answers[i], self.cell_clues[i], self.types[i])
+
+    def cells(self):
+        return [self.cell(i) for i in range(len(self.answers))]
+
+    def __eq__(self, other):
+        return isinstance(other, PuzzleModel) and all(getattr(self, x) == getattr(other, x) for x in PUZZLE_FIELDS)
+
+    def __repr__(self):
+        return f"PuzzleModel({self.width}x{self.height}, {len(self.clues)} clues, {self.publication_date!r})"
+
+
+class Cell:
+    # One square of the grid, see PuzzleModel for what each part is
+    __slots__ = CELL_FIELDS
+
+    def __init__(self, index, answer=None, more_answers=None, clues=(), type=None):
+        self.index = index
+        self.answer = answer
+        self.more_answers = more_answers
+        self.clues = clues
+        self.type = type
+
+    def __eq__(self, other):
+        return isinstance(other, Cell) and all(getattr(self, x) == getattr(other, x) for x in CELL_FIELDS)
+
+    def __repr__(self):
+        return f"Cell({', '.join(repr(getattr(self, x)) for x in CELL_FIELDS)})"
+
+
+class Clue:
+    # A clue, the text is still HTML here
+    __slots__ = CLUE_FIELDS
+
+    def __init__(self, label, direction, text):
+        self.label = label
+        self.direction = direction
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, Clue) and all(getattr(self, x) == getattr(other, x) for x in CLUE_FIELDS)
+
+    def __repr__(self):
+        return f"Clue({', '.join(repr(getattr(self, x)) for x in CLUE_FIELDS)})"
+
+
+def make_clue(clue):
+    # The text comes as a string, a dict with a "plain" version, or a list of either
+    text = clue.get("text", "")
+    if isinstance(text, list):
+        text = text[0] if len(text) > 0 else ""
+    if isinstance(text, dict):
+        text = text.get("plain", "")
+    return Clue(clue.get("label"), clue.get("direction"), text)
+
+
+def build_puzzle(width, height, body, meta):
+    # body has the cells and clues, meta has everything else.  Going through
+    # the cells once for each list is quicker than once for all of them
+    cells = body["cells"]
+    more_answers = [x.get("moreAnswers") for x in cells]
+    more_answers = [x["valid"] if isinstance(x, dict) else x for x in more_answers]
+    notes = meta.get("notes")
+    return PuzzleModel(
+        width, height,
+        [x.get("answer") for x in cells],
+        more_answers,
+        [x.get("clues", []) for x in cells],
+        [x.get("type") for x in cells],
+        [x.get("index", i) for i, x in enumerate(cells)],
+        [make_clue(x) for x in body["clues"]],
+        publication_date=meta.get("publicationDate"),
+        puzzle_id=meta.get("id"),
+        title=meta.get("title"),
+        constructors=meta.get("constructors") or (),
+        editor=meta.get("editor"),
+        copyright=meta.get("copyright"),
+        notes=[x["text"] for x in notes if "text" in x] if notes is not None else (),
+    )
+
+
+def from_v6(new_format):
+    # The puzzle JSON from the v6 API, this doesn't change new_format
+    body = new_format["body"][0]
+    return build_puzzle(body["dimensions"]["width"], body["dimensions"]["height"], body, new_format)
+
+
+def from_game_data(data):
+    # The older game data, or anything that looks like it, as nyt.normalize_puzzle makes
+    data = data["gamePageData"]
+    return build_puzzle(data["dimensions"]["columnCount"], data["dimensions"]["rowCount"], data, data.get("meta", {}))
+
+
+def load(data):
+    # A model from any of the formats, or the model itself if it already is one
+    if isinstance(data, PuzzleModel):
+        return data
+    if "gamePageData" in data:
+        return from_game_data(data)
+    return from_v6(data)
+
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly")
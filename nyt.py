@@ -1,14 +1,36 @@
 #!/usr/bin/env python3
 
-import base64, browser_cookie3, datetime, decompress, html, json
-import os, puz, re, requests, requests.utils, sys, time, version
+# browser_cookie3, cache, decompress, and puz are imported where they're used,
+# they're slow to import, and most runs only need some of them
+import atexit, base64, codecs, datetime, fetch, functools, html, json
+import model, os, re, sys, threading, time, urllib.parse, version
 if sys.version_info >= (3, 11): from datetime import UTC
 else: import datetime as datetime_fix; UTC=datetime_fix.timezone.utc
 
+# Cache puzzle data on disk, in CACHE_FOLDER, useful for debugging, or
+# for repeatedly converting the same puzzles
 CACHE_DATA = False
+CACHE_FOLDER = ".cached"
 # Debug code to log all URL requests and their responses, set to None
 # to disable logging, any string enables (and is replaced with a log filename)
 LOG_CALLS = None
+# Set to the filename of a log from LOG_CALLS to serve every request from
+# that log, instead of the website, useful for testing things offline
+REPLAY_CALLS = None
+# Where the website lives, this can be pointed to a server from local_server.py
+# for testing, either here, or with the NYTXW_BASE_URL environment variable
+NYT_BASE_URL = os.environ.get("NYTXW_BASE_URL", "https://www.nytimes.com")
+# Cookies that show we're logged into NYTimes.com, cookies cached on disk are
+# only reused while all of these are there and not about to expire
+AUTH_COOKIES = ["NYT-S"]
+# Cookies without an expiration, and cookies cached by older versions, are
+# trusted for this long after they were saved
+COOKIE_SESSION_AGE = 24 * 60 * 60
+# Go back to the browser for cookies this many seconds before they expire
+COOKIE_EXPIRY_MARGIN = 5 * 60
+COOKIE_CACHE_VERSION = 2
+# How long, in seconds, to go between checks for a newer version
+VERSION_CHECK_AGE = 24 * 60 * 60
 
 # These unicode characters are just used to draw the crossword grid to stdout
 BLOCK_LEFT = "\u2590"
@@ -72,6 +94,10 @@ LATIN1_SUBS = {
     56186: '', 65038: '', 65039: '', 65533: '', 
 }
 
+# Bump this whenever LATIN1_SUBS, or how translit_default fills in the
+# rest of the characters, changes
+TRANSLIT_VERSION = 1
+
 # Replace some emoticons and other oddball phrases that might lose meaning 
 # if the individual characters are fixed
 EMOTICON_SUBS = {
@@ -83,6 +109,11 @@ EMOTICON_SUBS = {
     '\u0e1b\u0e23\u0e30\u0e40\u0e17\u0e28\u0e44\u0e17\u0e22': '[Thailand]',
     '\u0eaa\u0eb0\u0e9a\u0eb2\u0e8d\u0e94\u0eb5': '[Hello in Lao]',
 }
+# All of the emoticons, to find them in one pass, longest first, so the longest one wins
+EMOTICON_RE = re.compile("|".join(re.escape(k) for k in sorted(EMOTICON_SUBS, key=len, reverse=True)))
+# A character from each emoticon, preferring uncommon ones, if a string has none of
+# these, there's no need to look for emoticons in it
+EMOTICON_REQUIRED = sorted({next((c for c in k if not c.isascii()), k[0]) for k in EMOTICON_SUBS})
 
 # Some rules to remove HTML like things with text versions for the .puz files
 HTML_TO_TEXT_RULES = [
@@ -111,16 +142,54 @@ HTML_TO_TEXT_RULES = [
     ("&#x([0-9a-fA-F]+);", lambda m: chr(int(m.group(1), 16))),
 ]
 
+# How many of latin1ify's conversions to keep around
+LATIN1IFY_CACHE_SIZE = 4096
+# How many puzzles data_to_puz_many hands to a worker process at a time
+DATA_TO_PUZ_CHUNK_SIZE = 16
+
+# The same rules, done in a single pass over the string, see html_to_text
+HTML_ENTITY_SUBS = {pattern[1:-1]: repl for pattern, repl in HTML_TO_TEXT_RULES if re.fullmatch("&[a-z]+;", pattern)}
+HTML_TOKEN_RE = re.compile(
+    "<(?P<close>/?)(?P<tag>i|em|sub|sup|s)>"
+    "|(?P<br><br(?: /|)>)"
+    "|(?P<other><[^<>]+>)"
+    "|&(?P<name>" + "|".join(HTML_ENTITY_SUBS) + ");"
+    "|&#(?P<dec>[0-9]+);"
+    "|&#x(?P<hex>[0-9a-fA-F]+);"
+    "|(?P<bare>[<&])"
+)
+# Anything left in the output that one of the rules would have turned into something else
+HTML_LEFTOVER_ENTITY_RE = re.compile("&(" + "|".join(HTML_ENTITY_SUBS) + "|#[0-9]+|#x[0-9a-fA-F]+);")
+# What each tag turns into, when opened, and when closed
+HTML_TAG_SUBS = {
+    "i": ("_", "_"),
+    "em": ("_", "_"),
+    "sub": ("", ""),
+    "sup": ("", ""),
+    "s": ("[*cross out* ", "]"),
+}
 
-def get_browsers():
-    return {
-        "Chrome": browser_cookie3.chrome,
-        "Chromium": browser_cookie3.chromium,
 
-        "Opera": browser_cookie3.opera,
-        "Microsoft Edge": browser_cookie3.edge,
-        "Firefox": browser_cookie3.firefox,
-    }
+# Each browser, and the browser_cookie3 function that loads its cookies
+BROWSERS = {
+    "Chrome": "chrome",
+    "Chromium": "chromium",
+
+    "Opera": "opera",
+    "Microsoft Edge": "edge",
+    "Firefox": "firefox",
+}
+
+
+def browser_loader(func_name):
+    def helper(**kwargs):
+        import browser_cookie3
+        return getattr(browser_cookie3, func_name)(**kwargs)
+    return helper
+
+
+def get_browsers():
+    return {name: browser_loader(func_name) for name, func_name in BROWSERS.items()}
 
 
 def get_user_filename(filename):
@@ -172,52 +241,299 @@ def pick_browser():
 
 
 # Internal helper to load a URL, optionally log the data, to make
-# debugging remotely a tiny bit easier
-def get_url(cookies, url):
-    cookies = requests.utils.cookiejar_from_dict(cookies)
-    if LOG_CALLS is not None:
-        with open(LOG_CALLS, "a", newline="", encoding="utf-8") as f:
-            f.write("URL " + url + "\n")
-            f.write("COOKIES " + json.dumps(cookies, default=str) + "\n")
-            try:
-                f.write("COOKIES_RAW " + json.dumps(requests.utils.dict_from_cookiejar(cookies)) + "\n")
-            except:
-                pass
-    resp = requests.get(url, cookies=cookies).content
-    if LOG_CALLS is not None:
-        with open(LOG_CALLS, "a", newline="", encoding="utf-8") as f:
-            f.write("RESPONSE " + base64.b64encode(resp).decode("utf-8") + "\n")
+# debugging remotely a tiny bit easier.  All requests go through a shared
+# client so the connection to the server is kept alive between calls
+def get_url(cookies, url, client=None, context=None):
+    client, recorder = prepare_client(cookies, client, context)
+    resp = client.get(url, recorder)
     resp = resp.decode("utf-8")
     return resp
 
 
+def prepare_client(cookies, client=None, context=None):
+    # Get the client ready to make a request, returns it along with the
+    # context's log of all requests, if it's turned on, to pass to each
+    # request.  The client can be shared by contexts that log elsewhere
+    if client is None:
+        client = fetch.get_client()
+    if context is None:
+        context = default_context()
+    recorder = context.recorder()
+    if recorder is not None:
+        recorder.record_cookies(cookies)
+    client.set_cookies(cookies)
+    return client, recorder
+
+
+# The two ways a puzzle page can include the puzzle, either the data itself
+# as an encoded string, or a small JSON blob with a key to look up the puzzle
+GAME_DATA_RE = re.compile("(pluribus|window.gameData) *= *['\"](?P<data>.*?)['\"]")
+GAME_KEY_RE = re.compile("window\\.gameData *= *(?P<json>{.*?})")
+# Where either of the above can start
+GAME_LEAD_RE = re.compile("pluribus|window.gameData")
+
+
+class GameDataScanner:
+    # Looks for the game data in a puzzle page as it downloads, so we can stop
+    # reading the page as soon as it's found.  Neither pattern can match across
+    # a line, so only the current line needs to be kept around, and only from
+    # where a match could start
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self.match = None
+        self.kind = None
+
+    def feed(self, chunk, final=False):
+        text = self._text + self._decoder.decode(chunk, final)
+
+        for kind, pattern in (("data", GAME_DATA_RE), ("key", GAME_KEY_RE)):
+            m = pattern.search(text)
+            if m is not None:
+                self.kind, self.match = kind, m
+                return True
+
+        # Nothing yet, throw away everything before where a match could start:
+        # the first possible start on the last line, which is still being read
+        line = text.rfind("\n") + 1
+        lead = GAME_LEAD_RE.search(text, line)
+        if lead is not None:
+            self._text = text[lead.start():]
+        else:
+            self._text = text[max(line, len(text) - len("window.gameData")):]
+        return False
+
+
+def scan_url(cookies, url, client=None, context=None):
+    # Like get_url, but only downloads as much of a puzzle page as needed
+    # to find the game data, returns the scanner with the results
+    client, recorder = prepare_client(cookies, client, context)
+    return client.stream(url, GameDataScanner, recorder=recorder)
+
+
 def get_cookie_cache_filename():
     return get_user_filename("nytxw_puz.cookies.json")
 
 
+def read_cookie_cache():
+    # Load the cookies cached on disk, returns None if there aren't any.  Older
+    # versions only saved the cookies themselves, with no idea of which browser
+    # they came from, or when they expire
+    fn = get_cookie_cache_filename()
+    try:
+        with open(fn, "rt") as f:
+            data = json.load(f)
+        saved = os.path.getmtime(fn)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != COOKIE_CACHE_VERSION or not isinstance(data.get("cookies"), dict):
+        data = {"version": COOKIE_CACHE_VERSION, "browser": None, "saved": saved, "cookies": data, "expires": {}}
+    return data
+
+
+def write_cookie_cache(browser, jar):
+    # Save the cookies from a browser's cookie jar, along with when each of them
+    # expires, returns the cookies
+    cookies, expires = {}, {}
+    for cookie in jar:
+        cookies[cookie.name] = cookie.value
+        expires[cookie.name] = cookie.expires
+    data = {
+        "version": COOKIE_CACHE_VERSION,
+        "browser": browser,
+        "saved": time.time(),
+        "cookies": cookies,
+        "expires": expires,
+    }
+    import cache
+    cache.atomic_write(get_cookie_cache_filename(), json.dumps(data).encode("utf-8"))
+    return cookies
+
+
+def cookies_still_good(data, now=None):
+    # Are all of the cookies that log us into NYTimes.com there, and not about to expire?
+    if now is None:
+        now = time.time()
+    for name in AUTH_COOKIES:
+        if name not in data["cookies"]:
+            return False
+        expires = data["expires"].get(name)
+        if expires is None:
+            expires = data["saved"] + COOKIE_SESSION_AGE
+        if expires - COOKIE_EXPIRY_MARGIN <= now:
+            return False
+    return True
+
+
+class CookieProvider:
+    # Hands out the cookies for a browser.  They're kept in memory for the life
+    # of the process, and cached on disk between runs, only going back to the
+    # browser, which can be slow, when the cached cookies are about to expire
+    # or the website turns them down
+    def __init__(self, browser):
+        self.browser = browser
+        self.cookies = None
+        self.from_browser = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self.cookies is None:
+                self._load()
+            return self.cookies
+
+    def _load(self, force=False):
+        data = read_cookie_cache()
+        if self.browser == "Cached Cookies":
+            # The user asked for the cached cookies, so use them as they are
+            if data is None:
+                raise FileNotFoundError(get_cookie_cache_filename())
+            self.cookies, self.from_browser = data["cookies"], False
+        elif not force and data is not None and data["browser"] == self.browser and cookies_still_good(data):
+            self.cookies, self.from_browser = data["cookies"], False
+        else:
+            jar = get_browsers()[self.browser](domain_name='nytimes.com')
+            self.cookies, self.from_browser = write_cookie_cache(self.browser, jar), True
+
+    def invalidate(self, cookies):
+        # The website turned down these cookies, get new ones from the browser if that
+        # could help.  Returns True if there are different cookies to try
+        with self._lock:
+            if cookies is not self.cookies:
+                # Another thread already replaced them
+                return True
+            if self.browser == "Cached Cookies" or self.from_browser:
+                return False
+            self._load(force=True)
+            return True
+
+
+_cookie_providers = {}
+_cookie_providers_lock = threading.Lock()
+def get_cookie_provider(browser):
+    with _cookie_providers_lock:
+        if browser not in _cookie_providers:
+            _cookie_providers[browser] = CookieProvider(browser)
+        return _cookie_providers[browser]
+
+
 def load_cookies(browser):
     # Pull out the nytimes cookies from the user's browser
     # Cache the information to avoid a roundtrip to the browser if possible
-    if browser == "Cached Cookies":
-        with open(get_cookie_cache_filename(), "rt") as f:
-            cookies = json.load(f)
-    else:
-        cookies = get_browsers()[browser](domain_name='nytimes.com')
-        cookies = requests.utils.dict_from_cookiejar(cookies)
-        with open(get_cookie_cache_filename(), "wt") as f:
-            json.dump(cookies, f)
-
-    return cookies
+    return get_cookie_provider(browser).get()
 
 
-def get_puzzle_from_id(cookies, puzzle_id):
-    # Get the puzzle itself
-    puzzle_url = f"https://www.nytimes.com/svc/crosswords/v6/puzzle/{puzzle_id}.json"
-    new_format = get_url(cookies, puzzle_url)
-    new_format = json.loads(new_format)
-
+def call_with_cookies(browser, func, *args):
+    # Call func(cookies, *args) with the cookies for a browser, if the website says
+    # we're not logged in, get fresh cookies and try once more.  A browser of None
+    # means no cookies at all, as when talking to a local server or a log
+    if browser is None:
+        return func({}, *args)
+    provider = get_cookie_provider(browser)
+    cookies = provider.get()
+    try:
+        return func(cookies, *args)
+    except fetch.AuthError:
+        if not provider.invalidate(cookies):
+            raise
+    return func(provider.get(), *args)
+
+
+class ConversionContext:
+    # The settings and state for getting and converting puzzles, so several
+    # can be worked on at once, in threads, each with their own settings.  It's
+    # passed to the functions below like a fetch.Client is, and if none is
+    # given, they use one made from the module globals, by default_context()
+    def __init__(self, log_calls=None, cache_data=False, cache_folder=CACHE_FOLDER, diagnostics=None,
+                 source=None, store_errors=None, extra_message=None):
+        # Like LOG_CALLS, CACHE_DATA, and CACHE_FOLDER
+        self.log_calls = log_calls
+        self.cache_data = cache_data
+        self.cache_folder = cache_folder
+        # Like latin1ify_diagnostics, store_latin1ify_errors, and extra_latin1ify_message,
+        # source is the label diagnostics are recorded under
+        self.diagnostics = diagnostics
+        self.source = source
+        self.store_errors = store_errors
+        self.extra_message = extra_message
+
+    def copy(self, **changes):
+        # A new context with the same settings, other than any changes given,
+        # the diagnostics and store_errors are shared with this one
+        ret = ConversionContext.__new__(ConversionContext)
+        ret.__dict__.update(self.__dict__)
+        ret.__dict__.update(changes)
+        return ret
+
+    def response_cache(self):
+        return get_response_cache(self.cache_folder)
+
+    def recorder(self):
+        # The log of all requests, or None if log_calls isn't set
+        if self.log_calls is None:
+            return None
+        return get_recorder(self.log_calls)
+
+    # The same as the functions with these names, using this context, in a
+    # form that can be handed to call_with_cookies
+    def get_url(self, cookies, url, client=None):
+        return get_url(cookies, url, client, self)
+
+    def get_puzzle_from_id(self, cookies, puzzle_id, client=None):
+        return get_puzzle_from_id(cookies, puzzle_id, client, self)
+
+    def get_puzzle(self, url, browser, client=None):
+        return get_puzzle(url, browser, client, self)
+
+    def latin1ify(self, s):
+        return latin1ify(s, self)
+
+    def data_to_puz(self, puzzle):
+        return data_to_puz(puzzle, self)
+
+
+def default_context():
+    # A context from the module globals, made as needed, so changes to
+    # the globals are always seen
+    return ConversionContext(
+        log_calls=LOG_CALLS, cache_data=CACHE_DATA, cache_folder=CACHE_FOLDER,
+        diagnostics=latin1ify_diagnostics, store_errors=store_latin1ify_errors, extra_message=extra_latin1ify_message,
+    )
+
+
+_response_caches = {}
+_response_caches_lock = threading.Lock()
+def get_response_cache(folder=None):
+    # Only open a cache the first time it's needed, and make sure the
+    # index is saved out when we're done
+    if folder is None:
+        folder = CACHE_FOLDER
+    with _response_caches_lock:
+        if folder not in _response_caches:
+            import cache
+            _response_caches[folder] = cache.ResponseCache(folder)
+            atexit.register(_response_caches[folder].flush)
+        return _response_caches[folder]
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+def get_recorder(filename):
+    # One recorder for each log file, shared by every context logging to it
+    with _recorders_lock:
+        if filename not in _recorders:
+            _recorders[filename] = fetch.Recorder(filename)
+        return _recorders[filename]
+
+
+def puzzle_cache_key(puzzle_id):
+    return f"puzzle_id:{puzzle_id}"
+
+
+def normalize_puzzle(new_format):
     # The response is formatted somewhat differently than it used to be, so create a format
-    # that looks like it used to
+    # that looks like it used to.  This changes new_format, nothing here needs this
+    # anymore, since model.from_v6 reads the new format as is
     resp = new_format["body"][0]
     resp["meta"] = {}
     # TODO: Notes might be stored elsewhere, need to verify
@@ -232,107 +548,195 @@ def get_puzzle_from_id(cookies, puzzle_id):
     return resp
 
 
-def get_puzzle(url, browser):
-    cache = {}
-    if CACHE_DATA:
-        # Simple cache, useful for debugging, grows to stupid
-        # size over time, so it's off generally
-        if os.path.isfile(".cached.json"):
-            with open(".cached.json", "r", encoding="utf-8") as f:
-                cache = json.load(f)
+def get_puzzle_json(cookies, puzzle_id, client=None, context=None, base=None):
+    # Get the puzzle itself, as the raw JSON the v6 API returns, from base,
+    # the site of the page that led here, if there was one
+    if context is None:
+        context = default_context()
+    if context.cache_data:
+        new_format = context.response_cache().get(puzzle_cache_key(puzzle_id))
+        if new_format is not None:
+            return new_format
+
+    if base is None:
+        base = NYT_BASE_URL
+    puzzle_url = f"{base}/svc/crosswords/v6/puzzle/{puzzle_id}.json"
+    new_format = get_url(cookies, puzzle_url, client, context)
+    new_format = json.loads(new_format)
 
-    if url not in cache:
-        print(f"Loading {url}...")
+    if context.cache_data:
+        context.response_cache().put(puzzle_cache_key(puzzle_id), new_format)
+    return new_format
 
-        cookies = load_cookies(browser)
-        for _ in range(4):
-            # Load the webpage, its inline javascript includes the puzzle data
-            resp = get_url(cookies, url)
 
-            # NY Times is moving to a new system for puzzles, handle both, since 
-            # it doesn't seem to have migrated 100% of the accounts out there
+def get_puzzle_from_id(cookies, puzzle_id, client=None, context=None, base=None):
+    return model.from_v6(get_puzzle_json(cookies, puzzle_id, client, context, base))
 
-            # Option #1, see if this is the old style encoded javascript blob:
-            # Look for the javascript, it's easist here to just use a regex
-            m = re.search("(pluribus|window.gameData) *= *['\"](?P<data>.*?)['\"]", resp)
-            if m is not None:
-                # Pull out the data element
-                resp = m.group("data")
-                if "%" in resp:
-                    # Which is url-encoded
-                    resp = decompress.decode(resp)
-                    # And LZString compressed
-                    resp = decompress.decompress(resp)
-                else:
-                    # New format, this is now base64 encoded
-                    resp = base64.b64decode(resp).decode("utf-8")
-                    # And _then_ url-encoded
-                    resp = decompress.decode(resp)
-                # And a JSON blob
-                resp = json.loads(resp)
-                # All done, we can stop retries
-                break
 
-            # Option #2, try the new version with a gaming REST endpoint:
-            # Try to find the puzzle description:
-            m = re.search("window\\.gameData *= *(?P<json>{.*?})", resp)
-            if m is not None:
-                # Pull out the puzzle key
-                key = m.group("json")
-                key = json.loads(key)
-                key = key['filename']
+# Puzzle pages that are just a date, like "/crosswords/game/daily/2021/06/03",
+# or a bare date like "2021-06-03", which is taken to be a daily puzzle
+DATE_URL_RE = re.compile("(/crosswords/game/(?P<kind>[a-z]+)/(?P<y1>[0-9]{4})/(?P<m1>[0-9]{2})/(?P<d1>[0-9]{2})/?([?#].*)?"
+                         "|^(?P<y2>[0-9]{4})-(?P<m2>[0-9]{2})-(?P<d2>[0-9]{2}))$")
 
-                # Request the puzzle meta-data
-                api = f"https://www.nytimes.com/svc/crosswords/v6/puzzle/{key}.json"
-                metadata = get_url(cookies, api)
-                metadata = json.loads(metadata)
 
-                resp = get_puzzle_from_id(cookies, metadata['id'])
+def get_site(url):
+    # The "https://host" part of a URL
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
 
-                # All done
-                break
 
-            # Something didn't look right, try again
-            time.sleep(1)
+def resolve_puzzle_url(url):
+    # Work out the game page for a URL, along with the v6 API call for that
+    # date's puzzle if it's a URL for a date, so we can skip loading the game
+    # page.  Returns the page URL, and the API URL or None
+    m = DATE_URL_RE.search(url.strip())
+    if m is None:
+        return url, None
+    if m.group("kind") is not None:
+        # Use the same site the page is on for the API
+        base = get_site(url.strip())
+        kind, (year, month, day) = m.group("kind"), m.group("y1", "m1", "d1")
+    else:
+        base = NYT_BASE_URL
+        kind, (year, month, day) = "daily", m.group("y2", "m2", "d2")
+        url = f"{base}/crosswords/game/{kind}/{year}/{month}/{day}"
+    return url, f"{base}/svc/crosswords/v6/puzzle/{kind}/{year}-{month}-{day}.json"
+
+
+def get_puzzle(url, browser, client=None, context=None):
+    if context is None:
+        context = default_context()
+    if context.cache_data:
+        # Pages are cached either as the puzzle data itself, the v6 puzzle
+        # JSON, or as the ID of a puzzle, which is in turn cached on its own
+        found = context.response_cache().get(url)
+        if found is not None:
+            if "gameData" in found:
+                return model.from_game_data(found["gameData"])
+            if "puzzle" in found:
+                return model.from_v6(found["puzzle"])
+            new_format = context.response_cache().get(puzzle_cache_key(found["puzzle_id"]))
+            if new_format is not None:
+                return model.from_v6(new_format)
+
+    print(f"Loading {url}...")
+
+    # There's no need for cookies if the client isn't talking to the website
+    if client is None:
+        client = fetch.get_client()
+    if client.offline:
+        browser = None
+    return call_with_cookies(browser, load_puzzle, url, client, context)
+
+
+def load_puzzle(cookies, url, client, context=None):
+    if context is None:
+        context = default_context()
+    # If this is a puzzle for a date, try to go straight to the puzzle itself
+    page_url, api = resolve_puzzle_url(url)
+    if api is not None:
+        try:
+            new_format = json.loads(get_url(cookies, api, client, context))
+            # Make sure this looks like a puzzle before using it
+            if "dimensions" not in new_format["body"][0]:
+                raise ValueError("No puzzle in response")
+        except (fetch.FetchError, ValueError, KeyError, IndexError, TypeError):
+            # Didn't work, fall back to the game page
+            new_format = None
+        if new_format is not None:
+            if context.cache_data:
+                context.response_cache().put(url, {"puzzle": new_format})
+            return model.from_v6(new_format)
+
+    # Load the webpage, its inline javascript includes the puzzle data.  Errors
+    # talking to the server are retried by the client as needed.  We only
+    # read the page up to the point the puzzle data is found
+    scanner = scan_url(cookies, page_url, client, context)
+    m = scanner.match
+
+    # NY Times is moving to a new system for puzzles, handle both, since 
+    # it doesn't seem to have migrated 100% of the accounts out there
+
+    # Option #1, see if this is the old style encoded javascript blob:
+    # The scanner looks for the javascript, it's easist there to just use a regex
+    if scanner.kind == "data":
+        import decompress
+        # Pull out the data element
+        resp = m.group("data")
+        if "%" in resp:
+            # Which is url-encoded
+            resp = decompress.decode(resp)
+            # And LZString compressed
+            resp = decompress.decompress(resp)
+        else:
+            # New format, this is now base64 encoded
+            resp = base64.b64decode(resp).decode("utf-8")
+            # And _then_ url-encoded
+            resp = decompress.decode(resp)
+        # And a JSON blob
+        resp = json.loads(resp)
+        found = {"gameData": resp}
+        resp = model.from_game_data(resp)
+    else:
+        # Option #2, try the new version with a gaming REST endpoint:
+        # Try to find the puzzle description:
+        if scanner.kind != "key":
+            # Something didn't look right, loading the page again won't fix it
+            if "NYT-S" not in cookies:
+                raise fetch.AuthError(f"No puzzle found at {url}, and the cookies are not logged into NYTimes.com", url)
+            raise fetch.NoMatchError(f"No puzzle found at {url}, the page layout may have changed", url)
+
+        # Pull out the puzzle key
+        key = m.group("json")
+        key = json.loads(key)
+        key = key['filename']
+
+        # Request the puzzle meta-data, and then the puzzle, from the same
+        # site the page is on
+        site = get_site(page_url)
+        api = f"{site}/svc/crosswords/v6/puzzle/{key}.json"
+        metadata = get_url(cookies, api, client, context)
+        metadata = json.loads(metadata)
+
+        resp = get_puzzle_from_id(cookies, metadata['id'], client, context, site)
+        found = {"puzzle_id": metadata['id']}
+
+    if context.cache_data:
+        context.response_cache().put(url, found)
 
-        cache[url] = resp
-        if CACHE_DATA:
-            with open(".cached.json", "w", newline="", encoding="utf-8") as f:
-                json.dump(cache, f)
-    
-    return cache[url]
+    return resp
 
 
 def print_puzzle(p):
-    # Dump out the puzzle, just a helper mostly to debug things
-    p = p['gamePageData']
-    width, height = p["dimensions"]["columnCount"], p["dimensions"]["rowCount"]
+    # Dump out the puzzle, just a helper mostly to debug things, p can
+    # be in any format model.load takes
+    p = model.load(p)
+    width, height = p.width, p.height
     for y in range(height):
         row = " "
         extra = ""
         shown = ""
         for x in range(width):
-            cell = y * width + x
-            cell = p["cells"][cell]
-            if 'moreAnswers' in cell:
+            cell = p.cell(y * width + x)
+            if cell.more_answers is not None:
                 # This is an oddball answer, note all the possibilities
                 row += "- "
                 temp = []
-                if 'answer' in cell:
-                    temp += [cell['answer']]
-                temp += cell['moreAnswers']['valid']
+                if cell.answer is not None:
+                    temp += [cell.answer]
+                temp += cell.more_answers
                 temp = f" ({', '.join(temp)})"
                 if temp != shown:
                     shown = temp
                     extra += temp
-            elif 'answer' in cell:
+            elif cell.answer is not None:
                 # Normal answer, but if it's a rebus answer, show the first character
                 # and the rebus answer to the side
-                if len(cell['answer']) > 1:
-                    extra += " " + cell['answer']
-                    row += cell['answer'][0].lower() + " "
+                if len(cell.answer) > 1:
+                    extra += " " + cell.answer
+                    row += cell.answer[0].lower() + " "
                 else:
-                    row += cell['answer'] + " "
+                    row += cell.answer + " "
             else:
                 # Non-clue cell, just mark it
                 row += "# "
@@ -345,59 +749,290 @@ def print_puzzle(p):
         print(" " + row + extra)
 
 
+def html_to_text_rules(s):
+    # Apply each of the HTML_TO_TEXT_RULES in turn
+    for pattern, repl in HTML_TO_TEXT_RULES:
+        s = re.sub(pattern, repl, s)
+    return s
+
+
+def html_to_text(s):
+    # Does the same as html_to_text_rules, in one pass over the string.  The rules
+    # are applied one after another, so each sees the results of the ones before
+    # it.  That only matters for unusual strings, like tags that cross each
+    # other, or entities that only appear once others are replaced, and those
+    # are left to html_to_text_rules
+    if "<" not in s and "&" not in s:
+        return s
+
+    ret = []
+    # Each open tag, as [tag, index in ret of the opening text, could be a numeric <sup>]
+    stack = []
+    pos = 0
+    for m in HTML_TOKEN_RE.finditer(s):
+        text = s[m.start():m.end()]
+        if pos < m.start():
+            between = s[pos:m.start()]
+            if len(stack) > 0 and not note_tag_text(stack, between):
+                return html_to_text_rules(s)
+            ret.append(between)
+        pos = m.end()
+
+        tag = m.group("tag")
+        if tag is not None:
+            if m.group("close"):
+                # Tags need to be closed in order, and not left hanging
+                if len(stack) == 0 or stack[-1][0] != tag:
+                    return html_to_text_rules(s)
+                _, start, numeric = stack.pop()
+                if numeric and any(ret[start + 1:]):
+                    # "<sup>2</sup>" -> "^2"
+                    ret[start] = "^"
+                ret.append(HTML_TAG_SUBS[tag][1])
+            else:
+                # The same tag inside itself gets paired up differently by the rules
+                if any(cur[0] == tag for cur in stack):
+                    return html_to_text_rules(s)
+                if tag != "sub":
+                    not_numeric(stack)
+                stack.append([tag, len(ret), tag == "sup"])
+                ret.append(HTML_TAG_SUBS[tag][0])
+            continue
+
+        # Anything else inside a tag means it's not a numeric <sup>
+        if len(stack) > 0:
+            if not note_tag_text(stack, text):
+                return html_to_text_rules(s)
+            not_numeric(stack)
+
+        if m.group("br") is not None:
+            ret.append(" / ")
+        elif m.group("other") is not None:
+            pass
+        elif m.group("name") is not None:
+            ret.append(HTML_ENTITY_SUBS[m.group("name")])
+        elif m.group("dec") is not None or m.group("hex") is not None:
+            value = int(m.group("dec"), 10) if m.group("dec") is not None else int(m.group("hex"), 16)
+            if value > sys.maxunicode:
+                # Let the rules raise the error for this
+                return html_to_text_rules(s)
+            ret.append(chr(value))
+        elif text == "<" and ">" in s[pos:]:
+            # This might be the start of something that looks like a tag
+            return html_to_text_rules(s)
+        else:
+            ret.append(text)
+
+    if len(stack) > 0:
+        return html_to_text_rules(s)
+    ret.append(s[pos:])
+    ret = "".join(ret)
+    if "&" in ret and HTML_LEFTOVER_ENTITY_RE.search(ret) is not None:
+        # Something like "&amp;lt;", the rules turn that into "<"
+        return html_to_text_rules(s)
+    return ret
+
+
+def note_tag_text(stack, text):
+    # Some text inside of tags, returns False if the rules wouldn't pair up the tags
+    if "\n" in text:
+        return False
+    if text.strip("0123456789 ") != "":
+        not_numeric(stack)
+    return True
+
+
+def not_numeric(stack):
+    # Only one <sup> can be open, and it might be under a <sub>
+    for cur in stack:
+        cur[2] = False
+
+
+class Latin1ifyDiagnostics:
+    # Collects the characters latin1ify couldn't convert, instead of printing
+    # a warning for each one, and call summary() at the end.  Each warning is
+    # recorded under the source, something like the filename, of the
+    # ConversionContext it came from.  That's passed in to each record call,
+    # so threads can share one collector, as long as each converts with its
+    # own context, like context.copy(source=fn)
+    def __init__(self, max_samples=3):
+        self.max_samples = max_samples
+        # Each by code point: how often it was seen, how often in each
+        # source, and a few of the strings it was in
+        self.counts = {}
+        self.sources = {}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getstate__(self):
+        # These are sent back from the worker processes of data_to_puz_many,
+        # everything but the lock can go along
+        ret = dict(self.__dict__)
+        del ret["_lock"]
+        return ret
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def merge(self, other):
+        # Add in everything from another collector
+        with self._lock:
+            for code, count in other.counts.items():
+                self.counts[code] = self.counts.get(code, 0) + count
+                per_source = self.sources.setdefault(code, {})
+                for source, count in other.sources[code].items():
+                    per_source[source] = per_source.get(source, 0) + count
+                samples = self.samples.setdefault(code, [])
+                for sample in other.samples[code]:
+                    if len(samples) < self.max_samples and sample not in samples:
+                        samples.append(sample)
+
+    def record(self, x, source_string, source):
+        code = ord(x)
+        with self._lock:
+            self.counts[code] = self.counts.get(code, 0) + 1
+            per_source = self.sources.setdefault(code, {})
+            per_source[source] = per_source.get(source, 0) + 1
+            samples = self.samples.setdefault(code, [])
+            if len(samples) < self.max_samples and source_string not in samples:
+                samples.append(source_string)
+
+    def as_dict(self):
+        # Everything collected, in a form that can be saved with json
+        import unicodedata
+        with self._lock:
+            return {
+                f"U+{code:04X}": {
+                    "char": chr(code),
+                    "name": unicodedata.name(chr(code), None),
+                    "count": count,
+                    "sources": {str(k): v for k, v in self.sources[code].items()},
+                    "samples": list(self.samples[code]),
+                }
+                for code, count in sorted(self.counts.items())
+            }
+
+    def summary(self):
+        # All of the warnings at once, the most common characters first
+        if len(self.counts) == 0:
+            return "No characters that will cause problems"
+        data = self.as_dict()
+        lines = [f"Warning: {len(data):,} character(s) will likely cause problems:"]
+        for key, cur in sorted(data.items(), key=lambda x: -x[1]["count"]):
+            lines.append(f"  {key} '{cur['char']}' {cur['name'] or ''}, seen {cur['count']:,} time(s) in {len(cur['sources']):,} source(s)")
+            for sample in cur["samples"]:
+                lines.append(f"    Source: '{sample}'")
+                lines.append(f"   Escaped: '{sample.encode('unicode_escape').decode('utf-8')}'")
+        return "\n".join(lines)
+
+
+# Set to a Latin1ifyDiagnostics to collect warnings there, rather than printing
+# them as they come up
+latin1ify_diagnostics = None
+# The older ways to see warnings: a dict that's filled in with each character
+# that causes problems, and a message printed before each warning
 store_latin1ify_errors = None
 extra_latin1ify_message = None
-def latin1ify(s):
+def latin1ify(s, context=None):
     source_string = s
 
     # Make a Unicode string compliant with the Latin-1 (ISO-8859-1) character
     # set; the Across Lite v1.3 format only supports Latin-1 encoding
+    if s.isascii() and s.isprintable() and "<" not in s and "&" not in s:
+        # Nothing to convert, the usual case, like the letters in the grid
+        return s.strip()
 
-    # Replace the emoticons first with an ASCII version:
-    for k, v in EMOTICON_SUBS.items():
-        s = s.replace(k, v)
-
-    # Replace HTML like things into plain text
-    for pattern, repl in HTML_TO_TEXT_RULES:
-        s = re.sub(pattern, repl, s)
-
-    # Use table to convert the most common Unicode glyphs
-    s = s.translate(LATIN1_SUBS)
-
-    # Convert anything remaining using replacements like '\N{WINKING FACE}'
-    s = s.encode('ISO-8859-1', 'namereplace').decode('ISO-8859-1')
-
-    s = s.strip()
+    s = latin1ify_convert(s)
+    if s.isascii() and s.isprintable():
+        return s
 
     # Warn on anything left over
+    if context is None:
+        context = default_context()
     for x in s:
         if not ' ' <= x <= '~':
-            if extra_latin1ify_message is not None:
-                print(extra_latin1ify_message)
-            print(f"Warning: '{x.encode('unicode_escape').decode("utf-8")}', or '{x}' will likely cause problems")
-            print(f" Source: '{source_string}'")
-            print(f"Escaped: '{source_string.encode('unicode_escape').decode("utf-8")}'")
-            if store_latin1ify_errors is not None:
-                store_latin1ify_errors[ord(x)] = x
+            if context.diagnostics is not None:
+                context.diagnostics.record(x, source_string, context.source)
+            else:
+                if context.extra_message is not None:
+                    print(context.extra_message)
+                print(f"Warning: '{x.encode('unicode_escape').decode('utf-8')}', or '{x}' will likely cause problems")
+                print(f" Source: '{source_string}'")
+                print(f"Escaped: '{source_string.encode('unicode_escape').decode('utf-8')}'")
+            if context.store_errors is not None:
+                context.store_errors[ord(x)] = x
 
     return s
 
 
-def gridchar(c):
-    if 'answer' in c:
+@functools.lru_cache(maxsize=LATIN1IFY_CACHE_SIZE)
+def latin1ify_convert(s):
+    # The conversion part of latin1ify, this doesn't depend on anything else,
+    # so the results are kept, since the same strings come up over and over
+
+    # Replace the emoticons first with an ASCII version:
+    if any(c in s for c in EMOTICON_REQUIRED):
+        s = EMOTICON_RE.sub(lambda m: EMOTICON_SUBS[m.group(0)], s)
+
+    # Replace HTML like things into plain text
+    s = html_to_text(s)
+
+    # Use table to convert the most common Unicode glyphs, and a default
+    # for everything else
+    s = s.translate(get_translit_table())
+
+    return s.strip()
+
+
+class TranslitTable(dict):
+    # LATIN1_SUBS, filled in with a default for any other character as it's
+    # seen, so a string can be converted with a single translate call
+    def __missing__(self, code):
+        value = translit_default(code)
+        self[code] = value
+        return value
+
+
+def translit_default(code):
+    import unicodedata
+    c = chr(code)
+    if ' ' <= c <= '~':
+        return c
+    # See if there's a plain version, like "\u00fd" -> "y", or "\ufb01" -> "fi"
+    plain = "".join(x for x in unicodedata.normalize("NFKD", c) if not unicodedata.combining(x))
+    if plain.isascii() and plain.isprintable() and len(plain.strip()) > 0:
+        return plain
+    # Latin-1 characters are left alone, anything else gets a name like '\N{WINKING FACE}'
+    return c.encode('ISO-8859-1', 'namereplace').decode('ISO-8859-1')
+
+
+_translit_table = None
+def get_translit_table():
+    global _translit_table
+    if _translit_table is None:
+        _translit_table = TranslitTable({
+            k: v.encode('ISO-8859-1', 'namereplace').decode('ISO-8859-1')
+            for k, v in LATIN1_SUBS.items()
+        })
+    return _translit_table
+
+
+def gridchar(c, context=None):
+    # c is a model.Cell
+    if c.answer is not None:
         # The usual case: just one letter
-        return latin1ify(c['answer'][0])
-    if 'moreAnswers' in c:
+        return latin1ify(c.answer[0], context)
+    if c.more_answers is not None:
         # 2022-05-01 'Blank Expressions' includes grid answers without
         # an actual 'answer', only an array of 'moreAnswers'
-        more = c.get('moreAnswers', [])
-        if isinstance(more, dict):
-            more = more['valid']
-
-        for a in more:
+        for a in c.more_answers:
             if len(a) == 1:
                 # First single-character one
-                return latin1ify(a)
+                return latin1ify(a, context)
         # No single-character answers
         return 'X'
 
@@ -405,17 +1040,15 @@ def gridchar(c):
     return '.'
 
 
-def gridrebus(c):
-    if 'answer' in c:
-        if len(c['answer']) > 1:
+def gridrebus(c, context=None):
+    # c is a model.Cell
+    if c.answer is not None:
+        if len(c.answer) > 1:
             # This cell has a rebus answer, but first, see if we can find a 
             # answer that's already easy to use
-            more = c.get('moreAnswers', [])
-            if isinstance(more, dict):
-                more = more['valid']
-            answers = [c['answer']] + more
+            answers = [c.answer] + (c.more_answers or [])
             for possible in answers:
-                if possible == latin1ify(possible) and len(possible) > 1:
+                if possible == latin1ify(possible, context) and len(possible) > 1:
                     # This is a possibility that works well
                     return possible
             # Nothing useful, just use the first clue
@@ -423,14 +1056,62 @@ def gridrebus(c):
     return None
 
 
-def data_to_puz(puzzle):
+# Single letter answers latin1ify would leave as they are, nearly every cell
+PLAIN_ANSWERS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+
+
+def clue_text(clue, context=None):
+    # The clues are HTML text here, so decode them
+    return latin1ify(html.unescape(clue.text), context)
+
+
+def compile_cells(puzzle, context=None):
+    # Everything data_to_puz needs from a model.PuzzleModel's cells, visiting
+    # each one once.  Returns the solution, the fill, the clues, the rebus
+    # answers as a list of (index, answer), and the indexes of any circled
+    # squares.  Across Lite expects the clues in crossword order, not the NYT
+    # clue order, so they're added in the order their first cell comes up
+    solution = []
+    fill = []
+    clues = []
+    rebus_cells = []
+    circled = []
+    seen = set()
+    clue_data = puzzle.clues
+    cells = zip(puzzle.answers, puzzle.more_answers, puzzle.cell_clues, puzzle.types, puzzle.indexes)
+    for i, (answer, more, cell_clues, kind, index) in enumerate(cells):
+        if answer is not None:
+            solution.append(answer[0] if answer[0] in PLAIN_ANSWERS else gridchar(puzzle.cell(i), context))
+            fill.append('-')
+            if len(answer) > 1:
+                rebus_cells.append((i, gridrebus(puzzle.cell(i), context)))
+        else:
+            solution.append('.' if more is None else gridchar(puzzle.cell(i), context))
+            fill.append('.')
+
+        for clue in cell_clues:
+            if clue not in seen:
+                seen.add(clue)
+                clues.append(clue_text(clue_data[clue], context))
+
+        if kind in (NYT_TYPE_CIRCLED, NYT_TYPE_GRAY):
+            circled.append(index)
+
+    return ''.join(solution), ''.join(fill), clues, rebus_cells, circled
+
+
+def data_to_puz(puzzle, context=None):
+    # puzzle can be a model.PuzzleModel, or any of the formats model.load takes
+    import puz
+    if context is None:
+        context = default_context()
+    puzzle = model.load(puzzle)
     p = puz.Puzzle()
-    data = puzzle['gamePageData']
 
     # Basic header
     p.title = 'New York Times Crossword'
-    if 'publicationDate' in data['meta']:
-        year, month, day = data['meta']['publicationDate'].split('-')
+    if puzzle.publication_date is not None:
+        year, month, day = puzzle.publication_date.split('-')
         d = datetime.date(int(year), int(month), int(day))
         months = ['', 'January', 'February', 'March', 'April', 'May', 'June',
                   'July', 'August', 'September', 'October', 'November', 'December']
@@ -438,68 +1119,187 @@ def data_to_puz(puzzle):
                'Saturday', 'Sunday']
         p.title = ('NY Times, ' + dow[d.weekday()] + ', ' + months[d.month] +
                    ' ' + str(d.day) + ', ' + str(d.year))
-        if 'title' in data['meta']:
-            p.title += ' ' + latin1ify(data['meta']['title'].upper())
-    elif 'title' in data['meta']:
-        p.title = latin1ify(data['meta']['title'].upper())
-    p.author = ', '.join(latin1ify(c) for c in data['meta']['constructors'])
-    if 'editor' in data['meta']:
-        p.author += ' / ' + latin1ify(data['meta']['editor'])
-    if 'copyright' in data['meta']:
-        p.copyright = '© ' + data['meta']['copyright'] + ', The New York Times'
+        if puzzle.title is not None:
+            p.title += ' ' + latin1ify(puzzle.title.upper(), context)
+    elif puzzle.title is not None:
+        p.title = latin1ify(puzzle.title.upper(), context)
+    p.author = ', '.join(latin1ify(c, context) for c in puzzle.constructors)
+    if puzzle.editor is not None:
+        p.author += ' / ' + latin1ify(puzzle.editor, context)
+    if puzzle.copyright is not None:
+        p.copyright = '© ' + puzzle.copyright + ', The New York Times'
 
     # Pull out the size of the puzzle
-    p.height = data["dimensions"]["rowCount"]
-    p.width = data["dimensions"]["columnCount"]
+    p.height = puzzle.height
+    p.width = puzzle.width
 
-    # Fill out the main grid
-    p.solution = ''.join(gridchar(x) for x in data['cells'])
-    p.fill = ''.join('-' if 'answer' in x else '.' for x in data['cells'])
-
-    # And the clues, they're HTML text here, so decode them, Across Lite expects them in
-    # crossword order, not the NYT clue order, order them correctly
-    seen = set()
-    clues = []
-    for cell in data['cells']:
-        for clue in cell.get('clues', []):
-            if clue not in seen:
-                seen.add(clue)
-                temp = data['clues'][clue]['text']
-                if isinstance(temp, list):
-                    temp = temp[0]
-                if isinstance(temp, dict):
-                    temp = temp.get("plain", "")
-                clues.append(latin1ify(html.unescape(temp)))
+    # Everything else from the grid comes from one pass over the cells
+    solution, fill, clues, rebus_cells, circled = compile_cells(puzzle, context)
+    p.solution = solution
+    p.fill = fill
     p.clues = clues
 
     # See if any of the answers is multi-character (rebus)
-    if max([len(x['answer']) for x in data['cells'] if 'answer' in x]) > 1:
+    if len(rebus_cells) > 0:
         # We have at least one rebus answer, so setup the rebus data fields
         rebus = p.create_empty_rebus()
-
-        # And find all the rebus answers and add them to the data
-        for cell in data['cells']:
-            rebus.add_rebus(gridrebus(cell))
+        rebus.table = [0] * len(puzzle)
+        for i, answer in rebus_cells:
+            rebus.set_rebus(i, answer)
 
     # See if any grid squares are marked up with circles
-    if any(x['type'] in (NYT_TYPE_CIRCLED, NYT_TYPE_GRAY) for x in data['cells'] if 'type' in x):
+    if len(circled) > 0:
         markup = p.markup()
         markup.markup = [0] * (p.width * p.height)
-
-        for i, cell in enumerate(data['cells']):
-            if 'type' in cell and cell['type'] in (NYT_TYPE_CIRCLED, NYT_TYPE_GRAY):
-                markup.markup[cell.get('index', i)] = puz.GridMarkup.Circled
+        for i in circled:
+            markup.markup[i] = puz.GridMarkup.Circled
 
     # Check for any notes in puzzle (e.g., Sep 11, 2008)
-    if data['meta'].get('notes', None) is not None:
-        p.notes = '\n\n'.join(latin1ify(x['text']) for x in data['meta']['notes']
-                              if 'text' in x)
+    if len(puzzle.notes) > 0:
+        p.notes = '\n\n'.join(latin1ify(x, context) for x in puzzle.notes)
 
     # All done
     return p
 
-def version_warn():
+def data_to_puz_many(puzzles, workers=None, ordered=True, chunksize=DATA_TO_PUZ_CHUNK_SIZE,
+                     as_bytes=False, sources=False, context=None):
+    # Convert a lot of puzzles, yielding (key, result) for each one.  The puzzles
+    # can be in any format data_to_puz takes, and key is the index of each one,
+    # or if sources is True, each item is a (source, puzzle) pair, and key is
+    # the source, which is also what warnings are recorded under.  The result
+    # is a puz.Puzzle, or its bytes if as_bytes is True.
+    #
+    # With no workers, or just one, everything is done here, one puzzle after
+    # the other, a single worker process would only add overhead.  Otherwise,
+    # the puzzles are handed out in chunks to that many processes, each of which
+    # keeps its latin1ify cache and transliteration table from chunk to chunk.
+    # The results come back in order, unless ordered is False, in which case
+    # they come back as soon as they're ready.  Any warnings are passed along
+    # to context, like they would be converting the puzzles one at a time
+    if context is None:
+        context = default_context()
+    items = puzzles if sources else enumerate(puzzles)
+
+    if workers is None or workers <= 1:
+        local = context.copy()
+        for key, puzzle in items:
+            if sources:
+                local.source = key
+            yield key, _data_to_puz_one(puzzle, as_bytes, local)
+        return
+
+    import collections, concurrent.futures, itertools
+    settings = {
+        "max_samples": None if context.diagnostics is None else context.diagnostics.max_samples,
+        "store_errors": context.store_errors is not None,
+        "extra_message": context.extra_message,
+        "source": context.source,
+        "sources": sources,
+        "as_bytes": as_bytes,
+    }
+    items = iter(items)
+    pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=_data_to_puz_many_init)
+    try:
+        # Only keep a few chunks per worker in flight, so the puzzles are
+        # read in as they're needed
+        pending = collections.deque()
+        def submit():
+            chunk = list(itertools.islice(items, chunksize))
+            if len(chunk) > 0:
+                pending.append(pool.submit(_data_to_puz_chunk, chunk, settings))
+        for _ in range(workers * 2):
+            submit()
+
+        while len(pending) > 0:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                future = next(x for x in pending if x in done)
+                pending.remove(future)
+            results, diagnostics, store_errors = future.result()
+            submit()
+            if diagnostics is not None:
+                context.diagnostics.merge(diagnostics)
+            if store_errors is not None:
+                context.store_errors.update(store_errors)
+            yield from results
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _data_to_puz_one(puzzle, as_bytes, context):
+    ret = data_to_puz(puzzle, context)
+    return ret.tobytes() if as_bytes else ret
+
+
+def _data_to_puz_many_init():
+    # Get the slow parts out of the way when a worker process starts
+    import puz
+    get_translit_table()
+
+
+def _data_to_puz_chunk(chunk, settings):
+    # Runs in a worker process, returns the results for a chunk, along with
+    # the warnings it ran into, to pass along to the caller's context
+    context = ConversionContext(
+        diagnostics=None if settings["max_samples"] is None else Latin1ifyDiagnostics(settings["max_samples"]),
+        source=settings["source"],
+        store_errors={} if settings["store_errors"] else None,
+        extra_message=settings["extra_message"],
+    )
+    results = []
+    for key, puzzle in chunk:
+        if settings["sources"]:
+            context.source = key
+        results.append((key, _data_to_puz_one(puzzle, settings["as_bytes"], context)))
+    return results, context.diagnostics, context.store_errors
+
+
+def get_version_cache_filename():
+    return get_user_filename("nytxw_puz.version.json")
+
+
+def check_version():
+    # Find the latest version, only asking GitHub if it hasn't been asked recently
+    fn = get_version_cache_filename()
+    try:
+        with open(fn, "rt") as f:
+            data = json.load(f)
+        if time.time() - data["checked"] < VERSION_CHECK_AGE:
+            return data["version"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
     ver = version.get_ver_from_github()
+    if ver is not None:
+        try:
+            with open(fn, "wt") as f:
+                json.dump({"checked": time.time(), "version": ver}, f)
+        except OSError:
+            pass
+    return ver
+
+
+_version_check = None
+def start_version_check():
+    # Look for a newer version in the background, GitHub can be slow, so
+    # nothing waits on this, version_warn shows the result once it's ready
+    global _version_check
+    if _version_check is None:
+        _version_check = {"version": None, "shown": False}
+        def worker():
+            _version_check["version"] = check_version()
+        _version_check["thread"] = threading.Thread(target=worker, daemon=True)
+        _version_check["thread"].start()
+
+
+def version_warn():
+    # Let the user know about a newer version, if the check has finished
+    if _version_check is None or _version_check["shown"] or _version_check["thread"].is_alive():
+        return
+    _version_check["shown"] = True
+    ver = _version_check["version"]
     if ver is not None:
         if ver > version.VERSION:
             print(f"Info: Version {ver} is available, consider upgrading if any issues occur")
@@ -514,8 +1314,9 @@ def main():
                 print(f"  {key}")
             exit(1)
     else:
-        version_warn()
+        start_version_check()
         browser = pick_browser()
+        version_warn()
         url = input("Enter the NY Times crossword URL: ")
         if len(url) == 0:
             print("No URL specified")
@@ -525,11 +1326,14 @@ def main():
             print("No output file specified")
             exit(1)
 
+    if REPLAY_CALLS is not None:
+        fetch.set_client(fetch.Client(transport=fetch.ReplayTransport(REPLAY_CALLS)))
+
     global LOG_CALLS
     if LOG_CALLS is not None:
         LOG_CALLS = output_fn + ".log"
-        with open(LOG_CALLS, "a", newline="", encoding="utf-8") as f:
-            f.write("LOG " + datetime.datetime.now(UTC).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S") + "\n")
+        get_recorder(LOG_CALLS).note("LOG " + datetime.datetime.now(UTC).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S"))
+    context = default_context()
 
     try:
         # url = "https://www.nytimes.com/crosswords/game/daily/2021/06/03"
@@ -537,16 +1341,17 @@ def main():
 
         # Get the puzzle from NYT, the first time this is called
         # the cookie will be archived
-        puzzle = get_puzzle(url, browser)
+        puzzle = get_puzzle(url, browser, context=context)
 
         # Useful for debugging, hidden by default since 
         # showing the solution kinda defeats the point
         # print_puzzle(puzzle)
 
         # And turn the puzzle data from NYT into a puz data structure
-        output = data_to_puz(puzzle)
+        output = data_to_puz(puzzle, context)
         output.save(os.path.expanduser(output_fn))
         print(f"Created {output_fn}")
+        version_warn()
         if sys.platform == 'darwin' and hasattr(sys, 'ps1'):
             input("Press enter to continue...")
     except:
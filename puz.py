@@ -217,11 +217,12 @@ class Puzzle:
             self.postscript = s.read_to_end()
 
         if not IGNORE_CHECKSUMS:
-            if cksum_gbl != self.global_cksum():
+            global_cksum, header_cksum, magic_cksum = self.cksums()
+            if cksum_gbl != global_cksum:
                 raise PuzzleFormatError('global checksum does not match')
-            if cksum_hdr != self.header_cksum():
+            if cksum_hdr != header_cksum:
                 raise PuzzleFormatError('header checksum does not match')
-            if cksum_magic != self.magic_cksum():
+            if cksum_magic != magic_cksum:
                 raise PuzzleFormatError('magic checksum does not match')
         for code, cksum_ext in ext_cksum.items():
             if cksum_ext != data_cksum(self.extensions[code]):
@@ -244,24 +245,23 @@ class Puzzle:
         # include any preamble text we might have found on read
         s.write(self.preamble)
 
+        # encode everything once, and use it for both the checksums and
+        # the data that's written
+        fields = self.encode_fields()
+        global_cksum, header_cksum, magic_cksum = self.cksums(fields)
         s.pack(HEADER_FORMAT,
-               self.global_cksum(), ACROSSDOWN,
-               self.header_cksum(), self.magic_cksum(),
+               global_cksum, ACROSSDOWN,
+               header_cksum, magic_cksum,
                self.fileversion, self.unk1, self.scrambled_cksum,
                self.unk2, self.width, self.height,
                len(self.clues), self.puzzletype, self.solution_state)
 
-        s.write(self.encode(self.solution))
-        s.write(self.encode(self.fill))
-
-        s.write_string(self.title)
-        s.write_string(self.author)
-        s.write_string(self.copyright)
-
-        for clue in self.clues:
-            s.write_string(clue)
-
-        s.write_string(self.notes)
+        solution, fill, text = fields
+        s.write(solution)
+        s.write(fill)
+        # title, author, copyright, clues, and notes
+        for part in text:
+            s.write(part)
 
         # do a bit of extra work here to ensure extensions round-trip in the
         # order they were read. this makes verification easier. But allow
@@ -367,54 +367,56 @@ class Puzzle:
                           self.width, self.height, len(self.clues),
                           self.puzzletype, self.solution_state), cksum)
 
-    def text_cksum(self, cksum=0):
+    def encode_fields(self):
+        # the solution, the fill, and the title, author, copyright, clues,
+        # and notes as null terminated strings, each encoded just once
+        text = [self.title, self.author, self.copyright] + self.clues + [self.notes]
+        return (self.encode(self.solution), self.encode(self.fill),
+                [self.encode_zstring(x or '') for x in text])
+
+    def text_cksum(self, cksum=0, text=None):
         # for the checksum to work these fields must be added in order with
         # null termination, followed by all non-empty clues without null
         # termination, followed by notes (but only for version >= 1.3)
-        if self.title:
-            cksum = data_cksum(self.encode_zstring(self.title), cksum)
-        if self.author:
-            cksum = data_cksum(self.encode_zstring(self.author), cksum)
-        if self.copyright:
-            cksum = data_cksum(self.encode_zstring(self.copyright), cksum)
-
-        for clue in self.clues:
-            if clue:
-                cksum = data_cksum(self.encode(clue), cksum)
+        if text is None:
+            text = self.encode_fields()[2]
+        # empty fields are just the null, and are left out
+        parts = [x for x in text[:3] if len(x) > 1]
+        parts.extend(x[:-1] for x in text[3:-1] if len(x) > 1)
 
         # notes included in global cksum starting v1.3 of format
-        if self.version_tuple() >= (1, 3) and self.notes:
-            cksum = data_cksum(self.encode_zstring(self.notes), cksum)
-
-        return cksum
-
-    def global_cksum(self):
-        cksum = self.header_cksum()
-        cksum = data_cksum(self.encode(self.solution), cksum)
-        cksum = data_cksum(self.encode(self.fill), cksum)
-        cksum = self.text_cksum(cksum)
+        if self.version_tuple() >= (1, 3) and len(text[-1]) > 1:
+            parts.append(text[-1])
+
+        # the checksum carries on from one field to the next, so it's the
+        # same as the checksum of them all joined together
+        return data_cksum(b''.join(parts), cksum)
+
+    def cksums(self, fields=None):
+        # the global, header, and magic checksums, working out each part of
+        # them once.  fields is from encode_fields, if it's already been
+        # called.  The global checksum carries on from the header through
+        # the solution, fill, and text, while the magic checksum starts
+        # each of them over from 0, so those two still need a pass each
+        if fields is None:
+            fields = self.encode_fields()
+        solution, fill, text = fields
+        header = self.header_cksum()
+        cksum_gbl = self.text_cksum(data_cksum(fill, data_cksum(solution, header)), text)
         # extensions do not seem to be included in global cksum
-        return cksum
-
-    def magic_cksum(self):
         cksums = [
-            self.header_cksum(),
-            data_cksum(self.encode(self.solution)),
-            data_cksum(self.encode(self.fill)),
-            self.text_cksum()
+            header,
+            data_cksum(solution),
+            data_cksum(fill),
+            self.text_cksum(0, text)
         ]
+        return cksum_gbl, header, mask_cksums(cksums)
 
-        cksum_magic = 0
-        for (i, cksum) in enumerate(reversed(cksums)):
-            cksum_magic <<= 8
-            cksum_magic |= (
-                ord(MASKSTRING[len(cksums) - i - 1]) ^ (cksum & 0x00ff)
-            )
-            cksum_magic |= (
-                (ord(MASKSTRING[len(cksums) - i - 1 + 4]) ^ (cksum >> 8)) << 32
-            )
+    def global_cksum(self):
+        return self.cksums()[0]
 
-        return cksum_magic
+    def magic_cksum(self):
+        return self.cksums()[2]
 
 
 class PuzzleBuffer:
@@ -572,13 +574,16 @@ class Rebus:
         )
 
     def add_rebus(self, answer):
-        if answer is None:
-            self.table.append(0)
-        else:
-            if answer not in self.temp:
-                self.temp[answer] = len(self.temp) + 1
-            self.solutions[f"{self.temp[answer]:2d}"] = answer
-            self.table.append(self.temp[answer] + 1)
+        self.table.append(0)
+        if answer is not None:
+            self.set_rebus(len(self.table) - 1, answer)
+
+    def set_rebus(self, index, answer):
+        # Like add_rebus, for a square that's already in the table
+        if answer not in self.temp:
+            self.temp[answer] = len(self.temp) + 1
+        self.solutions[f"{self.temp[answer]:2d}"] = answer
+        self.table[index] = self.temp[answer] + 1
 
     def has_rebus(self):
         return Extensions.Rebus in self.puzzle.extensions
@@ -635,20 +640,42 @@ class Markup:
 
 
 # helper functions for cksums and scrambling
+
+# Each step of the checksum rotates it right by one, with wrap-around, then
+# adds in the next byte.  _cksum_rotate has the rotation for every value the
+# checksum can reach, including the ones past 16 bits from the addition,
+# which are cleared by the rotation, so each byte is a lookup and an add.
+# It's built the first time it's needed
+_cksum_rotate = None
+
+
 def data_cksum(data, cksum=0):
+    global _cksum_rotate
+    if _cksum_rotate is None:
+        _cksum_rotate = [((x & 0xffff) >> 1) | ((x & 0x0001) << 15) for x in range(0x10000 + 0x100)]
+
+    rotate = _cksum_rotate
     for b in data:
-        if isinstance(b, bytes):
-            b = ord(b)
-        # right-shift one with wrap-around
-        lowbit = (cksum & 0x0001)
-        cksum = (cksum >> 1)
-        if lowbit:
-            cksum = (cksum | 0x8000)
-
-        # then add in the data and clear any carried bit past 16
-        cksum = (cksum + b) & 0xffff
-
-    return cksum
+        cksum = rotate[cksum] + b
+
+    # clear any carried bit past 16
+    return cksum & 0xffff
+
+
+def mask_cksums(cksums):
+    # combine the header, solution, fill, and text checksums into the
+    # magic checksum
+    cksum_magic = 0
+    for (i, cksum) in enumerate(reversed(cksums)):
+        cksum_magic <<= 8
+        cksum_magic |= (
+            ord(MASKSTRING[len(cksums) - i - 1]) ^ (cksum & 0x00ff)
+        )
+        cksum_magic |= (
+            (ord(MASKSTRING[len(cksums) - i - 1 + 4]) ^ (cksum >> 8)) << 32
+        )
+
+    return cksum_magic
 
 
 def replace_chars(s, chars, replacement=''):
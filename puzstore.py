@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# A store of puzzles, as model.PuzzleModel, in one compact binary file, so an
+# archive can be converted again, say after a change to LATIN1_SUBS, without
+# parsing all of the JSON again.  The file is memory mapped when it's read,
+# and any puzzle can be pulled out by date or puzzle ID without reading the
+# rest.  The layout is:
+#
+#   Header     MAGIC, SCHEMA_VERSION, the number of puzzles, and where the index is
+#   Puzzles    One after the other, see encode_puzzle
+#   Index      For each puzzle, its ID, date, and where it is in the file
+#
+# All numbers are little endian.  Bump SCHEMA_VERSION if the layout changes,
+# stores from other versions can't be read, and need to be built again
+
+from array import array
+import datetime, json, mmap, os, struct, sys, tempfile
+import model
+
+MAGIC = b"NYTXWPZ\0"
+SCHEMA_VERSION = 1
+HEADER = struct.Struct("<8sIIQ")            # Magic, version, count, index offset
+INDEX_ENTRY = struct.Struct("<qIQI")        # Puzzle ID, date, offset, length
+# Each puzzle starts with the length of each of its sections, see encode_puzzle
+SECTIONS = struct.Struct("<9I")
+
+# Lists of strings are stored joined by SEPARATOR, with NONE for a missing one
+SEPARATOR = "\0"
+NONE = "\x01"
+# Types are stored in a signed 16-bit array, with this for a missing one
+NO_TYPE = -1
+
+
+def date_to_ordinal(value):
+    # Dates are stored as a day number, 0 for none
+    if value is None:
+        return 0
+    return datetime.date.fromisoformat(value).toordinal()
+
+
+def encode_strings(values):
+    for cur in values:
+        if cur is not None and (SEPARATOR in cur or cur == NONE):
+            raise ValueError(f"Unable to store the string {cur!r}")
+    return SEPARATOR.join(NONE if x is None else x for x in values).encode("utf-8")
+
+
+def decode_strings(data, count):
+    if count == 0:
+        return []
+    return [None if x == NONE else x for x in str(data, "utf-8").split(SEPARATOR)]
+
+
+def encode_array(typecode, values):
+    ret = array(typecode, values)
+    if sys.byteorder != "little":
+        ret.byteswap()
+    return ret.tobytes()
+
+
+def decode_array(typecode, data):
+    ret = array(typecode)
+    ret.frombytes(data)
+    if sys.byteorder != "little":
+        ret.byteswap()
+    return ret.tolist()
+
+
+def encode_puzzle(puzzle):
+    # Turn a puzzle into bytes.  The details of the puzzle, and the odd parts
+    # of the grid, are JSON, everything per square or per clue is stored so
+    # it can be read back in a few big steps, rather than one value at a time:
+    #   0  JSON: the puzzle details
+    #   1  The answers
+    #   2  The types
+    #   3  Where each square's clues start in section 4, and where the last ends
+    #   4  The clues for every square
+    #   5  The text of each clue
+    #   6  The label of each clue
+    #   7  The direction of each clue
+    #   8  JSON: more_answers, and any indexes that aren't a square's position
+    puzzle = model.load(puzzle)
+    details = {
+        "width": puzzle.width,
+        "height": puzzle.height,
+        "cells": len(puzzle.answers),
+        "clues": len(puzzle.clues),
+        "publication_date": puzzle.publication_date,
+        "puzzle_id": puzzle.puzzle_id,
+        "title": puzzle.title,
+        "constructors": puzzle.constructors,
+        "editor": puzzle.editor,
+        "copyright": puzzle.copyright,
+        "notes": puzzle.notes,
+    }
+    odd = {
+        "more_answers": {i: x for i, x in enumerate(puzzle.more_answers) if x is not None},
+        "indexes": {i: x for i, x in enumerate(puzzle.indexes) if x != i},
+    }
+
+    starts = [0]
+    flat = []
+    for cur in puzzle.cell_clues:
+        flat.extend(cur)
+        starts.append(len(flat))
+
+    sections = [
+        json.dumps(details).encode("utf-8"),
+        encode_strings(puzzle.answers),
+        encode_array("h", [NO_TYPE if x is None else x for x in puzzle.types]),
+        encode_array("I", starts),
+        encode_array("I", flat),
+        encode_strings([x.text for x in puzzle.clues]),
+        encode_strings([x.label for x in puzzle.clues]),
+        encode_strings([x.direction for x in puzzle.clues]),
+        json.dumps(odd).encode("utf-8"),
+    ]
+    return SECTIONS.pack(*(len(x) for x in sections)) + b"".join(sections)
+
+
+def decode_puzzle(data):
+    # Turn bytes from encode_puzzle back into a puzzle, data can be
+    # anything that supports the buffer protocol, like a memoryview
+    data = memoryview(data)
+    sections = []
+    pos = SECTIONS.size
+    for size in SECTIONS.unpack_from(data):
+        sections.append(data[pos:pos + size])
+        pos += size
+
+    details = json.loads(bytes(sections[0]))
+    odd = json.loads(bytes(sections[8]))
+    cells, clues = details["cells"], details["clues"]
+
+    more_answers = [None] * cells
+    for i, value in odd["more_answers"].items():
+        more_answers[int(i)] = value
+    indexes = list(range(cells))
+    for i, value in odd["indexes"].items():
+        indexes[int(i)] = value
+    starts = decode_array("I", sections[3])
+    flat = decode_array("I", sections[4])
+
+    return model.PuzzleModel(
+        details["width"], details["height"],
+        decode_strings(sections[1], cells),
+        more_answers,
+        [flat[starts[i]:starts[i + 1]] for i in range(cells)],
+        [None if x == NO_TYPE else x for x in decode_array("h", sections[2])],
+        indexes,
+        [model.Clue(label, direction, text) for text, label, direction in zip(
+            decode_strings(sections[5], clues), decode_strings(sections[6], clues), decode_strings(sections[7], clues),
+        )],
+        publication_date=details["publication_date"],
+        puzzle_id=details["puzzle_id"],
+        title=details["title"],
+        constructors=details["constructors"],
+        editor=details["editor"],
+        copyright=details["copyright"],
+        notes=details["notes"],
+    )
+
+
+class PuzzleStoreWriter:
+    # Builds a store, add each puzzle, and close it when done.  The store is
+    # written to a temp file, and only moved into place once it's complete
+    def __init__(self, filename):
+        self.filename = filename
+        self._index = []
+        fd, self._temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".tmp_")
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(HEADER.pack(MAGIC, SCHEMA_VERSION, 0, 0))
+
+    def add(self, puzzle):
+        # puzzle can be a model.PuzzleModel, or anything model.load takes
+        puzzle = model.load(puzzle)
+        data = encode_puzzle(puzzle)
+        puzzle_id = -1 if puzzle.puzzle_id is None else puzzle.puzzle_id
+        self._index.append((puzzle_id, date_to_ordinal(puzzle.publication_date), self._file.tell(), len(data)))
+        self._file.write(data)
+
+    def close(self):
+        index_offset = self._file.tell()
+        for cur in self._index:
+            self._file.write(INDEX_ENTRY.pack(*cur))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, SCHEMA_VERSION, len(self._index), index_offset))
+        self._file.close()
+        os.replace(self._temp, self.filename)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self._temp)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PuzzleStore:
+    # Reads a store built by PuzzleStoreWriter.  Only the index is read when
+    # it's opened, each puzzle is decoded when it's asked for.  If there's
+    # more than one puzzle for a date or ID, the first one added is used
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a puzzle store")
+        if version != SCHEMA_VERSION:
+            self.close()
+            raise ValueError(f"{filename} is schema version {version}, not {SCHEMA_VERSION}, it needs to be built again")
+
+        self._entries = list(INDEX_ENTRY.iter_unpack(self._map[index_offset:index_offset + count * INDEX_ENTRY.size]))
+        self._by_id = {}
+        self._by_date = {}
+        for i, (puzzle_id, date, _, _) in enumerate(self._entries):
+            if puzzle_id != -1:
+                self._by_id.setdefault(puzzle_id, i)
+            if date != 0:
+                self._by_date.setdefault(date, i)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self, i):
+        _, _, offset, length = self._entries[i]
+        return decode_puzzle(memoryview(self._map)[offset:offset + length])
+
+    def get_by_id(self, puzzle_id, default=None):
+        i = self._by_id.get(puzzle_id)
+        return default if i is None else self._load(i)
+
+    def get_by_date(self, date, default=None):
+        # date is "YYYY-MM-DD", like the puzzles use
+        i = self._by_date.get(date_to_ordinal(date))
+        return default if i is None else self._load(i)
+
+    def dates(self):
+        return [datetime.date.fromordinal(x).isoformat() for x in sorted(self._by_date)]
+
+    def ids(self):
+        return sorted(self._by_id)
+
+    def __iter__(self):
+        # Every puzzle, in the order they were added
+        for i in range(len(self._entries)):
+            yield self._load(i)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def build_store(filename, puzzles):
+    # Write every puzzle out to a new store, returns how many there were
+    count = 0
+    with PuzzleStoreWriter(filename) as writer:
+        for cur in puzzles:
+            writer.add(cur)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly")
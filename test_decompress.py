@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+# A test harness around decompress.py, comparing the decompressor against
+# the original port, on data made with a port of LZString's compressor, and
+# the one pass decode against the original two pass version
+import decompress
+import base64, json, random, sys, time
+
+_commands = []
+def cmd(cmd, args, desc):
+    def helper(func):
+        _commands.append({"cmd": cmd, "args": args, "desc": desc, "func": func})
+        def wrapper(*args2, **kwargs):
+            return func(*args2, **kwargs)
+        return wrapper
+    return helper
+
+# The original decompress, kept as is, so the current one can be checked against it
+def reference_decompress(compressed):
+    if (compressed is None) or (compressed == ''):
+        return ''
+
+    dictionary = {}
+    enlargeIn = 4
+    dictSize = 4
+    numBits = 3
+    (entry, result, w, c) = ('', '', '', '')
+    (i, nnext, bits, resb, maxpower, power) = (0, 0, 0, 0, 0, 0)
+
+    data_string = compressed
+    data_val = ord(compressed[0])
+    data_position = 32768
+    data_index = 1
+
+    for i in range(3):
+        dictionary[i] = ''
+
+    bits = 0
+    maxpower = pow(2, 2)
+    power = 1
+
+    while power != maxpower:
+        resb = data_val & data_position
+        data_position >>= 1
+
+        if data_position == 0:
+            data_position = 32768
+            data_val = ord(data_string[data_index])
+            data_index += 1
+
+        bits |= (1 if resb > 0 else 0) * power
+        power <<= 1
+
+    nnext = bits
+    if nnext == 0:
+        bits = 0
+        maxpower = pow(2, 8)
+        power = 1
+
+        while power != maxpower:
+            resb = data_val & data_position
+            data_position >>= 1
+
+            if data_position == 0:
+                data_position = 32768
+                data_val = ord(data_string[data_index])
+                data_index += 1
+
+            bits |= (1 if resb > 0 else 0) * power
+            power <<= 1
+
+        c = chr(bits)
+    elif nnext == 1:
+        bits = 0
+        maxpower = pow(2, 16)
+        power = 1
+
+        while power != maxpower:
+            resb = data_val & data_position
+            data_position >>= 1
+
+            if data_position == 0:
+                data_position = 32768
+                data_val = ord(data_string[data_index])
+                data_index += 1
+
+            bits |= (1 if resb > 0 else 0) * power
+            power <<= 1
+
+        c = chr(bits)
+    elif nnext == 2:
+        return ''
+
+    dictionary[3] = c
+    result = c
+    w = result
+
+    while True:
+        if data_index > len(data_string):
+            return ''
+
+        bits = 0
+        maxpower = pow(2, numBits)
+        power = 1
+
+        while power != maxpower:
+            resb = data_val & data_position
+            data_position >>= 1
+
+            if data_position == 0:
+                data_position = 32768
+                data_val = ord(data_string[data_index])
+                data_index += 1
+
+            bits |= (1 if resb > 0 else 0) * power
+            power <<= 1
+
+        c = bits
+
+        if c == 0:
+            bits = 0
+            maxpower = pow(2, 8)
+            power = 1
+
+            while power != maxpower:
+                resb = data_val & data_position
+                data_position >>= 1
+
+                if data_position == 0:
+                    data_position = 32768
+                    data_val = ord(data_string[data_index])
+                    data_index += 1
+
+                bits |= (1 if resb > 0 else 0) * power
+                power <<= 1
+
+            dictionary[dictSize] = chr(bits)
+            dictSize += 1
+            c = dictSize - 1
+            enlargeIn -= 1
+        elif c == 1:
+            bits = 0
+            maxpower = pow(2, 16)
+            power = 1
+
+            while power != maxpower:
+                resb = data_val & data_position
+                data_position >>= 1
+
+                if data_position == 0:
+                    data_position = 32768
+                    data_val = ord(data_string[data_index])
+                    data_index += 1
+
+                bits |= (1 if resb > 0 else 0) * power
+                power <<= 1
+
+            dictionary[dictSize] = chr(bits)
+            dictSize += 1
+            c = dictSize - 1
+            enlargeIn -= 1
+        elif c == 2:
+            return result
+
+        if enlargeIn == 0:
+            enlargeIn = pow(2, numBits)
+            numBits += 1
+
+        if c in dictionary:
+            entry = dictionary[c]
+        else:
+            if c == dictSize:
+                entry = w + w[0]
+            else:
+                return None
+
+        result += entry
+
+        dictionary[dictSize] = w + entry[0]
+        dictSize += 1
+        enlargeIn -= 1
+
+        w = entry
+
+        if enlargeIn == 0:
+            enlargeIn = pow(2, numBits)
+            numBits += 1
+
+
+# Port of LZString's compress(), the "16 bits per character" flavor
+# that the NY Times used, to make test data
+def compress(uncompressed):
+    dictionary = {}
+    to_create = set()
+    w = ""
+    enlarge_in = 2
+    dict_size = 3
+    num_bits = 2
+    data = []
+    data_val = 0
+    data_position = 0
+
+    def write_bits(value, count):
+        # Bits are written starting with the low bit of the value
+        nonlocal data_val, data_position
+        for _ in range(count):
+            data_val = (data_val << 1) | (value & 1)
+            if data_position == 15:
+                data_position = 0
+                data.append(chr(data_val))
+                data_val = 0
+            else:
+                data_position += 1
+            value >>= 1
+
+    def write_w():
+        nonlocal enlarge_in, num_bits
+        if w in to_create:
+            if ord(w[0]) < 256:
+                write_bits(0, num_bits)
+                write_bits(ord(w[0]), 8)
+            else:
+                write_bits(1, num_bits)
+                write_bits(ord(w[0]), 16)
+            enlarge_in -= 1
+            if enlarge_in == 0:
+                enlarge_in = 1 << num_bits
+                num_bits += 1
+            to_create.remove(w)
+        else:
+            write_bits(dictionary[w], num_bits)
+        enlarge_in -= 1
+        if enlarge_in == 0:
+            enlarge_in = 1 << num_bits
+            num_bits += 1
+
+    for c in uncompressed:
+        if c not in dictionary:
+            dictionary[c] = dict_size
+            dict_size += 1
+            to_create.add(c)
+        wc = w + c
+        if wc in dictionary:
+            w = wc
+        else:
+            write_w()
+            dictionary[wc] = dict_size
+            dict_size += 1
+            w = c
+
+    if w != "":
+        write_w()
+
+    # Mark the end of the stream, and flush out the last character
+    write_bits(2, num_bits)
+    while True:
+        data_val <<= 1
+        if data_position == 15:
+            data.append(chr(data_val))
+            break
+        data_position += 1
+
+    return "".join(data)
+
+
+def make_text(rng, size, kind):
+    # Make up some text to compress, of a few different kinds
+    if kind == "puzzle":
+        # Something like the JSON the NY Times sent
+        cells = [{"answer": rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ"), "clues": [rng.randrange(80), rng.randrange(80)], "type": 1} for _ in range(225)]
+        clues = [{"label": str(i), "text": " ".join(rng.choice(["The", "a", "clue", "for", "Paris", "river", "été"]) for _ in range(6))} for i in range(80)]
+        text = ""
+        while len(text) < size:
+            text += json.dumps({"cells": cells, "clues": clues})
+            rng.shuffle(cells)
+        return text[:size]
+    if kind == "ascii":
+        return "".join(chr(rng.randrange(32, 127)) for _ in range(size))
+    if kind == "repeat":
+        return "".join(rng.choice(["ab", "abc", "a", "b"]) for _ in range(size))[:size]
+    # Anything in the BMP, including unpaired surrogates
+    return "".join(chr(rng.randrange(0, 0x10000)) for _ in range(size))
+
+
+def outcome(func, value):
+    # Either the result, or the type of error raised
+    try:
+        return func(value)
+    except Exception as e:
+        return type(e).__name__
+
+
+@cmd("bench", 2, "<size_kb> <count> = Time the decompressors on a large payload")
+def bench(size_kb, count):
+    text = make_text(random.Random(0), int(size_kb) * 1024, "puzzle")
+    data = compress(text)
+    count = int(count)
+    print(f"Payload: {len(text):,} characters, {len(data):,} compressed")
+    for desc, func in (("Original", reference_decompress), ("Current", decompress.decompress)):
+        start = time.perf_counter()
+        for _ in range(count):
+            if func(data) != text:
+                print(f"ERROR: {desc} didn't decompress correctly")
+                exit(1)
+        took = time.perf_counter() - start
+        print(f"  {desc}: {took / count * 1000:.2f}ms each")
+
+
+@cmd("diff", 2, "<count> <seed> = Compare the decompressors on random, and damaged, data")
+def diff(count, seed):
+    rng = random.Random(int(seed))
+    kinds = ["puzzle", "ascii", "repeat", "unicode"]
+    checked = 0
+    for i in range(int(count)):
+        kind = kinds[i % len(kinds)]
+        text = make_text(rng, rng.choice([0, 1, 2, 5, 50, 500, 5000]), kind)
+        data = compress(text)
+        tests = [data]
+        if len(data) > 1:
+            # Cut it short, and flip a bit, the results should still match
+            tests.append(data[:rng.randrange(1, len(data))])
+            pos = rng.randrange(len(data))
+            tests.append(data[:pos] + chr(ord(data[pos]) ^ (1 << rng.randrange(16))) + data[pos + 1:])
+        tests.append("".join(chr(rng.randrange(0x10000)) for _ in range(rng.randrange(1, 20))))
+
+        if decompress.decompress(data) != text:
+            print(f"ERROR: Unable to decompress {kind} text of {len(text):,} characters")
+            exit(1)
+        for cur in tests:
+            expected = outcome(reference_decompress, cur)
+            found = outcome(decompress.decompress, cur)
+            if found != expected:
+                print(f"ERROR: Different results for {cur!r}: {found!r} vs {expected!r}")
+                exit(1)
+            checked += 1
+    print(f"Checked {checked:,} payloads, all matched")
+
+
+def escape(text):
+    # Like javascript's escape(), which is how the NY Times encoded things
+    ret = []
+    for c in text:
+        if c.isascii() and (c.isalnum() or c in "@*_+-./"):
+            ret.append(c)
+        elif ord(c) < 256:
+            ret.append(f"%{ord(c):02X}")
+        else:
+            ret.append(f"%u{ord(c):04X}")
+    return "".join(ret)
+
+
+@cmd("decode_bench", 2, "<size_kb> <count> = Time decode on a large payload")
+def decode_bench(size_kb, count):
+    text = make_text(random.Random(0), int(size_kb) * 1024, "puzzle")
+    data = escape(text)
+    count = int(count)
+    print(f"Payload: {len(data):,} characters, {data.count('%'):,} escapes")
+    for desc, func in (("Two pass", decompress.decode_two_pass), ("Current", decompress.decode)):
+        start = time.perf_counter()
+        for _ in range(count):
+            if func(data) != text:
+                print(f"ERROR: {desc} didn't decode correctly")
+                exit(1)
+        took = time.perf_counter() - start
+        print(f"  {desc}: {took / count * 1000:.2f}ms each")
+
+
+@cmd("decode_diff", 2, "<count> <seed> = Compare decode with the two pass version on random data")
+def decode_diff(count, seed):
+    rng = random.Random(int(seed))
+    # Lean heavily on the pieces that make up escapes, to hit the odd cases
+    pieces = ["%", "%", "%u", "u", "0", "2", "5", "4", "1", "a", "F", "g", "x", "%25", "%u0025", "%u00", "\u00e9"]
+    for _ in range(int(count)):
+        value = "".join(rng.choice(pieces) for _ in range(rng.randrange(0, 12)))
+        if rng.random() < 0.2:
+            value = escape(make_text(rng, rng.randrange(0, 50), rng.choice(["ascii", "unicode"]))) + value
+        if decompress.decode(value) != decompress.decode_two_pass(value):
+            print(f"ERROR: Different results for {value!r}")
+            exit(1)
+    print(f"Checked {int(count):,} values, all matched")
+
+
+@cmd("decode_log", 1, "<log> = Compare decode with the two pass version on the puzzles in a log")
+def decode_log(log):
+    import fetch, nyt
+    checked = 0
+    for url, responses in fetch.read_recording(log).items():
+        for resp in responses:
+            for m in nyt.GAME_DATA_RE.finditer(resp.decode("utf-8", errors="replace")):
+                data = m.group("data")
+                values = [data]
+                if "%" not in data:
+                    try:
+                        values.append(base64.b64decode(data).decode("utf-8"))
+                    except ValueError:
+                        pass
+                for value in values:
+                    if decompress.decode(value) != decompress.decode_two_pass(value):
+                        print(f"ERROR: Different results for the data in {url}")
+                        exit(1)
+                    checked += 1
+    print(f"Checked {checked:,} payloads, all matched")
+
+
+def main():
+    args = sys.argv[1:]
+    for cur in _commands:
+        if len(args) == cur['args'] + 1 and args[0] == cur['cmd']:
+            cur['func'](*args[1:])
+            exit(0)
+
+    print("Usage:")
+    _commands.sort(key=lambda x: x['cmd'])
+    for cur in _commands:
+        print(f"  {cur['cmd']} {cur['desc']}")
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 
 # A test harness around testing latin1ify's implementation
 import nyt, puz
-import json, os, sys, zipfile
+import html, json, os, random, sys, time, zipfile
 
 _commands = []
 def cmd(cmd, args, desc):
@@ -49,11 +49,8 @@ def enum_files(root_dir):
                 with open(os.path.join(dirpath, fn)) as f:
                         yield fn, f.read()
 
-@cmd("test_archive", 1, "<root_dir> = Check all files in an archive folder")
-def test_archive(root_dir):
-    checked = 0
-
-    nyt.store_latin1ify_errors = {}
+def enum_archive_puzzles(root_dir):
+    # Every puzzle in an archive folder, ready for data_to_puz, as (filename, puzzle)
     for fn, cur in enum_files(root_dir):
         if "acrostic" not in fn:
             new_format = json.loads(cur)
@@ -74,17 +71,295 @@ def test_archive(root_dir):
                 resp = None
 
             if resp is not None:
-                checked += 1
-                nyt.extra_latin1ify_message = f"  On file {fn}..."
-                data = nyt.data_to_puz(resp)
-                if len(nyt.store_latin1ify_errors) > 10:
-                    break
+                yield fn, resp
+
+@cmd("test_archive", 1, "<root_dir> = Check all files in an archive folder")
+def test_archive(root_dir):
+    checked = 0
 
-    for key, value in nyt.store_latin1ify_errors.items():
-        print(f'    {key}: "{value}", # {chr(key).encode("unicode-escape").decode("utf-8")}')
+    diagnostics = nyt.Latin1ifyDiagnostics()
+    context = nyt.ConversionContext(diagnostics=diagnostics)
+    puzzles = enum_archive_puzzles(root_dir)
+    for fn, data in nyt.data_to_puz_many(puzzles, workers=os.cpu_count(), ordered=False, sources=True, context=context):
+        checked += 1
+        if len(diagnostics) > 10:
+            break
+
+    print(diagnostics.summary())
+    for key in diagnostics.counts:
+        print(f'    {key}: "{chr(key)}", # {chr(key).encode("unicode-escape").decode("utf-8")}')
 
     print(f"Checked {checked:,} files")
 
+@cmd("time_many", 2, "<root_dir> <workers> = Time data_to_puz_many on an archive, against one puzzle at a time")
+def time_many(root_dir, workers):
+    puzzles = [json.loads(cur) for fn, cur in enum_files(root_dir) if "acrostic" not in fn]
+    puzzles = [x for x in puzzles if "body" in x]
+
+    # data_to_puz changes the puzzles, so each run gets its own copy, made up front
+    copies = [json.loads(json.dumps(x)) for x in puzzles]
+    context = nyt.ConversionContext(diagnostics=nyt.Latin1ifyDiagnostics())
+    start = time.perf_counter()
+    expected = [nyt.data_to_puz(nyt.normalize_puzzle(x), context).tobytes() for x in copies]
+    took = time.perf_counter() - start
+    print(f"One at a time: {took:.3f}s, {len(puzzles) / took:,.1f} puzzles per second")
+
+    for desc, kwargs in (
+        ("In process", {}),
+        (f"{workers} workers, in order", {"workers": int(workers)}),
+        (f"{workers} workers, as ready", {"workers": int(workers), "ordered": False}),
+    ):
+        copies = [json.loads(json.dumps(x)) for x in puzzles]
+        diagnostics = nyt.Latin1ifyDiagnostics()
+        context = nyt.ConversionContext(diagnostics=diagnostics)
+        start = time.perf_counter()
+        found = {}
+        for i, data in nyt.data_to_puz_many(copies, as_bytes=True, context=context, **kwargs):
+            found[i] = data
+        took = time.perf_counter() - start
+        if [found[i] for i in range(len(puzzles))] != expected:
+            print(f"ERROR: Different results from {desc}")
+            exit(1)
+        print(f"{desc}: {took:.3f}s, {len(puzzles) / took:,.1f} puzzles per second, {sum(diagnostics.counts.values()):,} warning(s)")
+
+def outcome(func, value):
+    # Either the result, or the type of error raised
+    try:
+        return func(value)
+    except Exception as e:
+        return type(e).__name__
+
+# Pieces to build up random strings from, to hit the odd cases in html_to_text
+HTML_PIECES = [
+    "<i>", "</i>", "<em>", "</em>", "<sub>", "</sub>", "<sup>", "</sup>", "<s>", "</s>", "<br>", "<br />",
+    "<b>", "</b>", "<I>", "<", ">", "&", "&amp;", "&lt;", "&gt;", "&quot;", "&nbsp;", "&#49;", "&#x41;",
+    "&#1114112;", "lt;", "#49;", "amp;", "\n", " ", "1", "23", "a", "Bc", "\u00e9", "_", "^",
+]
+
+@cmd("diagnostics", 1, "<root_dir> = Convert every puzzle in an archive, and dump the latin1ify warnings as JSON")
+def diagnostics_json(root_dir):
+    diagnostics = nyt.Latin1ifyDiagnostics()
+    context = nyt.ConversionContext(diagnostics=diagnostics)
+    for fn, cur in enum_files(root_dir):
+        data = json.loads(cur)
+        if "acrostic" not in fn and "body" in data:
+            context.source = fn
+            nyt.data_to_puz(nyt.normalize_puzzle(data), context)
+    print(json.dumps(diagnostics.as_dict(), indent=4))
+
+@cmd("html_fuzz", 2, "<count> <seed> = Compare html_to_text with the original rules on random strings")
+def html_fuzz(count, seed):
+    rng = random.Random(int(seed))
+    for _ in range(int(count)):
+        value = "".join(rng.choice(HTML_PIECES) for _ in range(rng.randrange(0, 12)))
+        expected = outcome(nyt.html_to_text_rules, value)
+        found = outcome(nyt.html_to_text, value)
+        if found != expected:
+            print(f"ERROR: Different results for {value!r}: {found!r} vs {expected!r}")
+            exit(1)
+    print(f"Checked {int(count):,} strings, all matched")
+
+def enum_puzzle_text(root_dir):
+    # Every bit of text in every puzzle in an archive that goes through latin1ify
+    for fn, cur in enum_files(root_dir):
+        if "acrostic" in fn:
+            continue
+        data = json.loads(cur)
+        if "body" in data:
+            for cur in ["title", "editor", "copyright"]:
+                if isinstance(data.get(cur), str):
+                    yield fn, data[cur]
+            for cur in data.get("notes", []):
+                yield fn, cur.get("text", "")
+            data = data["body"][0]
+        for clue in data.get("clues", []):
+            for cur in clue.get("text", []):
+                if "plain" in cur:
+                    yield fn, cur["plain"]
+                    yield fn, html.unescape(cur["plain"])
+                if "formatted" in cur:
+                    yield fn, cur["formatted"]
+                    yield fn, html.unescape(cur["formatted"])
+
+@cmd("html_archive", 1, "<root_dir> = Compare html_to_text with the original rules on an archive, and time it")
+def html_archive(root_dir):
+    values = [value for _, value in enum_puzzle_text(root_dir)]
+    for value in values:
+        expected = outcome(nyt.html_to_text_rules, value)
+        found = outcome(nyt.html_to_text, value)
+        if found != expected:
+            print(f"ERROR: Different results for {value!r}: {found!r} vs {expected!r}")
+            exit(1)
+
+    # See how often the rules are still needed
+    fallbacks = 0
+    rules = nyt.html_to_text_rules
+    def counter(value):
+        nonlocal fallbacks
+        fallbacks += 1
+        return rules(value)
+    nyt.html_to_text_rules = counter
+    for value in values:
+        outcome(nyt.html_to_text, value)
+    nyt.html_to_text_rules = rules
+    print(f"Checked {len(values):,} strings, all matched, {fallbacks:,} needed the original rules")
+
+    for desc, func in (("Original rules", nyt.html_to_text_rules), ("Single pass", nyt.html_to_text)):
+        start = time.perf_counter()
+        for value in values:
+            outcome(func, value)
+        took = time.perf_counter() - start
+        print(f"  {desc}: {took:.3f}s")
+
+@cmd("time_archive", 1, "<root_dir> = Time converting every puzzle in an archive")
+def time_archive(root_dir):
+    puzzles = []
+    for fn, cur in enum_files(root_dir):
+        data = json.loads(cur)
+        if "acrostic" not in fn and "body" in data:
+            puzzles.append(data)
+
+    start = time.perf_counter()
+    for data in puzzles:
+        nyt.data_to_puz(nyt.normalize_puzzle(data))
+    took = time.perf_counter() - start
+    print(f"Converted {len(puzzles):,} puzzles in {took:.3f}s, {took / max(1, len(puzzles)) * 1000:.2f}ms each")
+    print(f"  {nyt.latin1ify_convert.cache_info()}")
+
+@cmd("parallel_archive", 2, "<root_dir> <threads> = Convert an archive in threads, each puzzle with its own context, and compare")
+def parallel_archive(root_dir, threads):
+    import concurrent.futures
+    puzzles = []
+    for fn, cur in enum_files(root_dir):
+        data = json.loads(cur)
+        if "acrostic" not in fn and "body" in data:
+            puzzles.append((fn, cur))
+
+    def convert(fn, cur):
+        # Each conversion keeps its warnings to itself
+        context = nyt.ConversionContext(diagnostics=nyt.Latin1ifyDiagnostics(), source=fn)
+        data = nyt.data_to_puz(nyt.normalize_puzzle(json.loads(cur)), context).tobytes()
+        return data, context.diagnostics
+
+    expected = [convert(fn, cur) for fn, cur in puzzles]
+    with concurrent.futures.ThreadPoolExecutor(int(threads)) as pool:
+        found = list(pool.map(lambda x: convert(*x), puzzles))
+
+    for (fn, _), (data, diagnostics), (expected_data, expected_diagnostics) in zip(puzzles, found, expected):
+        if data != expected_data:
+            print(f"ERROR: Different results for {fn}")
+            exit(1)
+        if diagnostics.as_dict() != expected_diagnostics.as_dict():
+            print(f"ERROR: Different warnings for {fn}")
+            exit(1)
+        if any(set(x) != {fn} for x in diagnostics.sources.values()):
+            print(f"ERROR: Warnings from other puzzles in {fn}")
+            exit(1)
+
+    # Again, with every thread sharing one collector, but converting with
+    # its own context, the warnings should still go to the right puzzle
+    shared = nyt.Latin1ifyDiagnostics()
+    context = nyt.ConversionContext(diagnostics=shared)
+    with concurrent.futures.ThreadPoolExecutor(int(threads)) as pool:
+        list(pool.map(lambda x: nyt.data_to_puz(nyt.normalize_puzzle(json.loads(x[1])), context.copy(source=x[0])), puzzles))
+    merged = nyt.Latin1ifyDiagnostics()
+    for _, diagnostics in expected:
+        merged.merge(diagnostics)
+    if shared.counts != merged.counts or shared.sources != merged.sources:
+        print("ERROR: Different warnings with a shared collector")
+        exit(1)
+    print(f"Converted {len(puzzles):,} puzzles in {int(threads)} threads, all matched")
+
+@cmd("store_build", 2, "<root_dir> <store> = Build a puzzle store from an archive")
+def store_build(root_dir, store):
+    import model, puzstore
+    start = time.perf_counter()
+    json_bytes = 0
+    def puzzles():
+        nonlocal json_bytes
+        for fn, cur in enum_files(root_dir):
+            data = json.loads(cur)
+            if "acrostic" not in fn and "body" in data:
+                json_bytes += len(cur)
+                yield model.from_v6(data)
+    count = puzstore.build_store(store, puzzles())
+    took = time.perf_counter() - start
+    print(f"Stored {count:,} puzzles in {took:.3f}s, {os.path.getsize(store):,} bytes, from {json_bytes:,} bytes of JSON")
+
+@cmd("store_time", 2, "<root_dir> <store> = Check a puzzle store against an archive, and time converting from each")
+def store_time(root_dir, store):
+    import model, puzstore
+    archive = [json.loads(cur) for fn, cur in enum_files(root_dir) if "acrostic" not in fn]
+    archive = {x["publicationDate"]: x for x in archive if "body" in x}
+    with puzstore.PuzzleStore(store) as ps:
+        if sorted(archive) != ps.dates():
+            print("ERROR: The store has different dates than the archive")
+            exit(1)
+        for when, data in archive.items():
+            puzzle = model.from_v6(data)
+            if ps.get_by_date(when) != puzzle or ps.get_by_id(data["id"]) != puzzle:
+                print(f"ERROR: Different puzzle in the store for {when}")
+                exit(1)
+        print(f"Checked {len(ps):,} puzzles, all matched")
+
+        context = nyt.ConversionContext(diagnostics=nyt.Latin1ifyDiagnostics())
+        raw = {when: json.dumps(data) for when, data in archive.items()}
+        start = time.perf_counter()
+        expected = [nyt.data_to_puz(json.loads(raw[x]), context).tobytes() for x in ps.dates()]
+        took_json = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [nyt.data_to_puz(ps.get_by_date(x), context).tobytes() for x in ps.dates()]
+        took_store = time.perf_counter() - start
+        if found != expected:
+            print("ERROR: Different results converting from the store")
+            exit(1)
+
+        # And just the loading part
+        start = time.perf_counter()
+        for x in ps.dates():
+            model.from_v6(json.loads(raw[x]))
+        load_json = time.perf_counter() - start
+        start = time.perf_counter()
+        for x in ps.dates():
+            ps.get_by_date(x)
+        load_store = time.perf_counter() - start
+
+    print(f"Loading: {load_json:.3f}s from JSON, {load_store:.3f}s from the store, {load_json / load_store:.2f}x")
+    print(f"Loading and converting: {took_json:.3f}s from JSON, {took_store:.3f}s from the store, {took_json / took_store:.2f}x")
+
+@cmd("translit_table", 1, "<root_dir> = Show how every character in an archive that's not in LATIN1_SUBS is converted")
+def translit_table(root_dir):
+    seen = {}
+    for fn, value in enum_puzzle_text(root_dir):
+        for x in value:
+            if not ' ' <= x <= '~' and ord(x) not in nyt.LATIN1_SUBS:
+                seen[ord(x)] = seen.get(ord(x), 0) + 1
+
+    # Print these out like "sort" does, so they can be added to LATIN1_SUBS if the
+    # default isn't good enough, remember to bump TRANSLIT_VERSION if so
+    print(f"# TRANSLIT_VERSION = {nyt.TRANSLIT_VERSION}, {len(seen):,} characters not in LATIN1_SUBS")
+    for key in sorted(seen):
+        print(f"    {key}: {python_escape(nyt.translit_default(key))}, # {python_escape(chr(key))}, seen {seen[key]:,} times")
+
+@cmd("emoticon_diff", 2, "<count> <seed> = Compare finding emoticons in one pass with replacing each in turn")
+def emoticon_diff(count, seed):
+    rng = random.Random(int(seed))
+    # Bits and pieces of the emoticons, and what they turn into
+    pieces = ["a", " ", "\u00e9"]
+    for key, value in nyt.EMOTICON_SUBS.items():
+        pieces += [key, value, key[:len(key) // 2], key[len(key) // 2:], key[0], key[-1]]
+    for _ in range(int(count)):
+        value = "".join(rng.choice(pieces) for _ in range(rng.randrange(0, 8)))
+        expected = value
+        for k, v in nyt.EMOTICON_SUBS.items():
+            expected = expected.replace(k, v)
+        found = nyt.latin1ify_convert.__wrapped__(value)
+        expected = nyt.latin1ify_convert.__wrapped__(expected)
+        if found != expected:
+            print(f"ERROR: Different results for {value!r}: {found!r} vs {expected!r}")
+            exit(1)
+    print(f"Checked {int(count):,} strings, all matched")
+
 @cmd("use_loader", 1, "<loader_py> = Use a loader module to test puzzles")
 def use_loader(loader_py):
     # Some of the loader helpers deal with semi-broken puz files
@@ -103,7 +378,8 @@ def use_loader(loader_py):
     module.__file__ = loader_py
     exec(code, module.__dict__)
 
-    nyt.store_latin1ify_errors = {}
+    diagnostics = nyt.Latin1ifyDiagnostics()
+    context = nyt.ConversionContext(diagnostics=diagnostics)
     checked = 0
 
     r = re.compile("&[#a-z0-9]+;")
@@ -111,16 +387,17 @@ def use_loader(loader_py):
         if not module.is_unusual(pretty):
             data = module.load_puzzle(fn)
             checked += 1
-            nyt.extra_latin1ify_message = f"  On file {pretty}..."
+            context.source = pretty
             for clue in data["clues"]:
-                temp = nyt.latin1ify(clue['clue'])
+                temp = nyt.latin1ify(clue['clue'], context)
                 if r.search(temp):
                     print("WARNING: HTML entity detected: " + temp)
-            if len(nyt.store_latin1ify_errors) > 0:
+            if len(diagnostics) > 0:
                 break
 
-    for key, value in nyt.store_latin1ify_errors.items():
-        print(f'    {key}: "{value}", # {python_escape(value)}')
+    print(diagnostics.summary())
+    for key in diagnostics.counts:
+        print(f'    {key}: "{chr(key)}", # {python_escape(chr(key))}')
 
     print(f"Checked {checked:,} files")
 
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+
+# A test harness around downloading and converting puzzles, these all
+# run offline, against logs recorded with nyt.LOG_CALLS turned on, or a
+# server from local_server.py
+import fetch, nyt
+import contextlib, hashlib, io, os, subprocess, sys, time
+
+# Modules that are slow to import, and that starting up shouldn't need
+HEAVY_MODULES = ["browser_cookie3", "requests", "urllib3", "cache", "decompress", "puz"]
+
+_commands = []
+def cmd(cmd, args, desc):
+    def helper(func):
+        _commands.append({"cmd": cmd, "args": args, "desc": desc, "func": func})
+        def wrapper(*args2, **kwargs):
+            return func(*args2, **kwargs)
+        return wrapper
+    return helper
+
+def convert_puzzle(url, client):
+    # Keep get_puzzle's progress messages out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        puzzle = nyt.get_puzzle(url, None, client)
+    return nyt.data_to_puz(puzzle).tobytes()
+
+# other/replay_2022-01-05.log is a small recording to try this with, of a
+# made up puzzle from local_server.py, for the URL
+# https://www.nytimes.com/crosswords/game/daily/2022/01/05
+@cmd("replay", 3, "<log> <url> <count> = Convert a puzzle from a log, and time it")
+def replay(log, url, count):
+    client = fetch.Client(transport=fetch.ReplayTransport(log))
+    data = convert_puzzle(url, client)
+    print(f"Puzzle: {len(data):,} bytes, SHA-256 {hashlib.sha256(data).hexdigest()}")
+
+    count = int(count)
+    start = time.perf_counter()
+    for _ in range(count):
+        # Each pass gets a fresh client, to start the log over again
+        client = fetch.Client(transport=fetch.ReplayTransport(log))
+        if convert_puzzle(url, client) != data:
+            print("ERROR: Conversion is not deterministic")
+            exit(1)
+    took = time.perf_counter() - start
+    print(f"Converted {count:,} times in {took:.3f}s, {took / count * 1000:.2f}ms each")
+
+@cmd("page_fallback", 0, "= Load a puzzle from a local server's game page, and check every request stays on that server")
+def page_fallback():
+    import local_server
+
+    class FailFirst:
+        # Fails the first request, the v6 call for the date, so the game
+        # page is used instead, and notes every URL asked for
+        def __init__(self, transport):
+            self.transport = transport
+            self.urls = []
+        def __getattr__(self, name):
+            return getattr(self.transport, name)
+        def get(self, url):
+            self.urls.append(url)
+            if len(self.urls) == 1:
+                raise fetch.NotFoundError(f"Not found: {url}", url, 404)
+            return self.transport.get(url)
+        def stream(self, url, chunk_size):
+            self.urls.append(url)
+            return self.transport.stream(url, chunk_size)
+
+    options = dict(local_server.OPTIONS)
+    options["port"] = 0
+    options["error-rate"] = 0.0
+    server, base_url = local_server.start_server(options)
+    client = fetch.Client()
+    client.transport = FailFirst(client.transport)
+    with contextlib.redirect_stdout(io.StringIO()):
+        nyt.get_puzzle(base_url + "/crosswords/game/daily/2022/01/05", None, client)
+    server.shutdown()
+
+    for url in client.transport.urls:
+        if not url.startswith(base_url):
+            print(f"ERROR: Asked {url}, not the page's site")
+            exit(1)
+    print(f"All {len(client.transport.urls)} requests went to {base_url}")
+
+@cmd("convert_log", 2, "<old_log> <new_log> = Convert an older text log to the newer format")
+def convert_log(old_log, new_log):
+    recorder = fetch.Recorder(new_log)
+    count = 0
+    for url, responses in fetch.read_recording(old_log).items():
+        for resp in responses:
+            recorder.record(url, resp)
+            count += 1
+    recorder.close()
+    print(f"Converted {count:,} responses")
+
+@cmd("load_test", 4, "<start> <end> <rate> <error_rate> = Download a range from a local server, and time it")
+def load_test(start, end, rate, error_rate):
+    import get_range, local_server, tempfile
+
+    options = dict(local_server.OPTIONS)
+    options["port"] = 0
+    options["error-rate"] = float(error_rate)
+    server, base_url = local_server.start_server(options)
+    nyt.NYT_BASE_URL = base_url
+    get_range.CALENDAR_BASE_URL = base_url
+
+    range_options = dict(get_range.OPTIONS)
+    range_options["rate"] = float(rate)
+    with tempfile.TemporaryDirectory() as dest_folder:
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            failed = get_range.download_range(None, start, end, dest_folder, range_options)
+        took = time.perf_counter() - start_time
+        created = len(os.listdir(dest_folder))
+    server.shutdown()
+
+    print(f"Created {created:,} puzzles in {took:.3f}s, {created / took:.2f} per second, {len(failed):,} failed")
+    for status, count in sorted(server.stats.items()):
+        print(f"  {status}: {count:,}")
+    if len(failed) > 0:
+        exit(1)
+
+def reference_gridchar(c):
+    # gridchar and gridrebus, from before they took a model.Cell
+    if 'answer' in c:
+        # The usual case: just one letter
+        return nyt.latin1ify(c['answer'][0])
+    if 'moreAnswers' in c:
+        # 2022-05-01 'Blank Expressions' includes grid answers without
+        # an actual 'answer', only an array of 'moreAnswers'
+        more = c.get('moreAnswers', [])
+        if isinstance(more, dict):
+            more = more['valid']
+
+        for a in more:
+            if len(a) == 1:
+                # First single-character one
+                return nyt.latin1ify(a)
+        # No single-character answers
+        return 'X'
+
+    # Black square
+    return '.'
+
+def reference_gridrebus(c):
+    if 'answer' in c:
+        if len(c['answer']) > 1:
+            # This cell has a rebus answer, but first, see if we can find a 
+            # answer that's already easy to use
+            more = c.get('moreAnswers', [])
+            if isinstance(more, dict):
+                more = more['valid']
+            answers = [c['answer']] + more
+            for possible in answers:
+                if possible == nyt.latin1ify(possible) and len(possible) > 1:
+                    # This is a possibility that works well
+                    return possible
+            # Nothing useful, just use the first clue
+            return answers[0]
+    return None
+
+def reference_data_to_puz(puzzle):
+    # data_to_puz as it was before compile_cells, to check the new one
+    # against, and time it
+    import datetime, html, puz
+    p = puz.Puzzle()
+    data = puzzle['gamePageData']
+
+    # Basic header
+    p.title = 'New York Times Crossword'
+    if 'publicationDate' in data['meta']:
+        year, month, day = data['meta']['publicationDate'].split('-')
+        d = datetime.date(int(year), int(month), int(day))
+        months = ['', 'January', 'February', 'March', 'April', 'May', 'June',
+                  'July', 'August', 'September', 'October', 'November', 'December']
+        dow = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+               'Saturday', 'Sunday']
+        p.title = ('NY Times, ' + dow[d.weekday()] + ', ' + months[d.month] +
+                   ' ' + str(d.day) + ', ' + str(d.year))
+        if 'title' in data['meta']:
+            p.title += ' ' + nyt.latin1ify(data['meta']['title'].upper())
+    elif 'title' in data['meta']:
+        p.title = nyt.latin1ify(data['meta']['title'].upper())
+    p.author = ', '.join(nyt.latin1ify(c) for c in data['meta']['constructors'])
+    if 'editor' in data['meta']:
+        p.author += ' / ' + nyt.latin1ify(data['meta']['editor'])
+    if 'copyright' in data['meta']:
+        p.copyright = '© ' + data['meta']['copyright'] + ', The New York Times'
+
+    # Pull out the size of the puzzle
+    p.height = data["dimensions"]["rowCount"]
+    p.width = data["dimensions"]["columnCount"]
+
+    # Fill out the main grid
+    p.solution = ''.join(reference_gridchar(x) for x in data['cells'])
+    p.fill = ''.join('-' if 'answer' in x else '.' for x in data['cells'])
+
+    # And the clues, they're HTML text here, so decode them, Across Lite expects them in
+    # crossword order, not the NYT clue order, order them correctly
+    seen = set()
+    clues = []
+    for cell in data['cells']:
+        for clue in cell.get('clues', []):
+            if clue not in seen:
+                seen.add(clue)
+                temp = data['clues'][clue]['text']
+                if isinstance(temp, list):
+                    temp = temp[0]
+                if isinstance(temp, dict):
+                    temp = temp.get("plain", "")
+                clues.append(nyt.latin1ify(html.unescape(temp)))
+    p.clues = clues
+
+    # See if any of the answers is multi-character (rebus)
+    if max([len(x['answer']) for x in data['cells'] if 'answer' in x]) > 1:
+        # We have at least one rebus answer, so setup the rebus data fields
+        rebus = p.create_empty_rebus()
+
+        # And find all the rebus answers and add them to the data
+        for cell in data['cells']:
+            rebus.add_rebus(reference_gridrebus(cell))
+
+    # See if any grid squares are marked up with circles
+    if any(x['type'] in (nyt.NYT_TYPE_CIRCLED, nyt.NYT_TYPE_GRAY) for x in data['cells'] if 'type' in x):
+        markup = p.markup()
+        markup.markup = [0] * (p.width * p.height)
+
+        for i, cell in enumerate(data['cells']):
+            if 'type' in cell and cell['type'] in (nyt.NYT_TYPE_CIRCLED, nyt.NYT_TYPE_GRAY):
+                markup.markup[cell.get('index', i)] = puz.GridMarkup.Circled
+
+    # Check for any notes in puzzle (e.g., Sep 11, 2008)
+    if data['meta'].get('notes', None) is not None:
+        p.notes = '\n\n'.join(nyt.latin1ify(x['text']) for x in data['meta']['notes']
+                              if 'text' in x)
+
+    # All done
+    return p
+
+# Odd things to put in a grid, to hit all of the cases in data_to_puz
+ODD_ANSWERS = ["a", "7", "\u00c9", "\u00df", "\u2603", " ", "&", "<", "HEART", "ONE", "\u00c9T\u00c9", "&amp;"]
+ODD_CLUES = [
+    [{"plain": "<i>Italic</i> &amp; more"}], [{"formatted": "No plain"}], {"plain": "A dict &lt;3"},
+    "Just a string", [{"plain": "Caf\u00e9 \u2014 x<sup>2</sup>"}], [{"plain": "\u00de"}],
+]
+
+def make_test_puzzle(size, rng=None):
+    # A made up puzzle from local_server, normalized, and with some rebus
+    # squares, circles, and other odd things in it if rng is given
+    import local_server, datetime
+    when = datetime.date(2020, 1, 1) + datetime.timedelta(days=size if rng is None else rng.randrange(1000))
+    data = nyt.normalize_puzzle(local_server.make_puzzle(when, size))
+    if rng is not None:
+        for i, cell in enumerate(data["cells"]):
+            roll = rng.random()
+            if "answer" in cell:
+                if roll < 0.05:
+                    cell["answer"] = rng.choice(ODD_ANSWERS)
+                elif roll < 0.08:
+                    cell["moreAnswers"] = {"valid": [rng.choice(ODD_ANSWERS) for _ in range(rng.randrange(3))]}
+                    cell["answer"] = rng.choice(ODD_ANSWERS)
+                elif roll < 0.12:
+                    cell["type"] = rng.choice([nyt.NYT_TYPE_CIRCLED, nyt.NYT_TYPE_GRAY, nyt.NYT_TYPE_INVISIBLE])
+                elif roll < 0.13:
+                    cell["index"] = rng.randrange(len(data["cells"]))
+                    cell["type"] = nyt.NYT_TYPE_CIRCLED
+            elif roll < 0.05:
+                cell["moreAnswers"] = [rng.choice(ODD_ANSWERS) for _ in range(rng.randrange(3))]
+        for clue in data["clues"]:
+            if rng.random() < 0.1:
+                clue["text"] = rng.choice(ODD_CLUES)
+    return data
+
+@cmd("convert_diff", 2, "<count> <seed> = Compare data_to_puz with the original on random puzzles")
+def convert_diff(count, seed):
+    import random
+    rng = random.Random(int(seed))
+    for _ in range(int(count)):
+        data = make_test_puzzle(rng.choice([3, 5, 15, 21]), rng)
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = reference_data_to_puz(data).tobytes()
+            found = nyt.data_to_puz(data).tobytes()
+        if found != expected:
+            print(f"ERROR: Different results for {data['meta']['publicationDate']}")
+            exit(1)
+    print(f"Checked {int(count):,} puzzles, all matched")
+
+@cmd("convert_bench", 1, "<count> = Time data_to_puz against the original for a few grid sizes")
+def convert_bench(count):
+    import model, random
+    count = int(count)
+    for desc, size in (("15x15", 15), ("21x21", 21), ("Oversized 75x75", 75)):
+        data = make_test_puzzle(size, random.Random(size))
+        puzzle = model.load(data)
+        print(f"{desc}:")
+        with contextlib.redirect_stdout(io.StringIO()):
+            if nyt.data_to_puz(data).tobytes() != reference_data_to_puz(data).tobytes():
+                print("ERROR: Different results", file=sys.stderr)
+                exit(1)
+            times = []
+            for func, value in ((reference_data_to_puz, data), (nyt.data_to_puz, data), (model.load, data), (nyt.data_to_puz, puzzle)):
+                start = time.perf_counter()
+                for _ in range(count):
+                    func(value)
+                times.append((time.perf_counter() - start) / count * 1000)
+        print(f"  Original: {times[0]:.3f}ms, One pass: {times[1]:.3f}ms, {times[0] / times[1]:.2f}x")
+        print(f"  Building the model: {times[2]:.3f}ms, One pass from the model: {times[3]:.3f}ms, {times[0] / times[3]:.2f}x")
+
+def reference_data_cksum(data, cksum=0):
+    # puz.data_cksum, as it was originally
+    for b in data:
+        if isinstance(b, bytes):
+            b = ord(b)
+        lowbit = (cksum & 0x0001)
+        cksum = (cksum >> 1)
+        if lowbit:
+            cksum = (cksum | 0x8000)
+        cksum = (cksum + b) & 0xffff
+    return cksum
+
+def reference_cksums(p):
+    # The global, header, and magic checksums for a puz.Puzzle, worked out
+    # the way puz.Puzzle originally did, one field at a time
+    import puz, struct
+    def header_cksum(cksum=0):
+        return reference_data_cksum(struct.pack(puz.HEADER_CKSUM_FORMAT, p.width, p.height, len(p.clues), p.puzzletype, p.solution_state), cksum)
+    def text_cksum(cksum=0):
+        for value in (p.title, p.author, p.copyright):
+            if value:
+                cksum = reference_data_cksum(p.encode_zstring(value), cksum)
+        for clue in p.clues:
+            if clue:
+                cksum = reference_data_cksum(p.encode(clue), cksum)
+        if p.version_tuple() >= (1, 3) and p.notes:
+            cksum = reference_data_cksum(p.encode_zstring(p.notes), cksum)
+        return cksum
+    cksum_gbl = reference_data_cksum(p.encode(p.fill), reference_data_cksum(p.encode(p.solution), header_cksum()))
+    cksum_gbl = text_cksum(cksum_gbl)
+    cksums = [header_cksum(), reference_data_cksum(p.encode(p.solution)), reference_data_cksum(p.encode(p.fill)), text_cksum()]
+    cksum_magic = 0
+    for i, cksum in enumerate(reversed(cksums)):
+        cksum_magic <<= 8
+        cksum_magic |= ord(puz.MASKSTRING[len(cksums) - i - 1]) ^ (cksum & 0x00ff)
+        cksum_magic |= (ord(puz.MASKSTRING[len(cksums) - i - 1 + 4]) ^ (cksum >> 8)) << 32
+    return cksum_gbl, header_cksum(), cksum_magic
+
+def make_test_puz(rng):
+    # A puz.Puzzle from a random test puzzle, with some of the fields the
+    # checksums treat differently changed
+    import puz
+    while True:
+        data = make_test_puzzle(rng.choice([3, 5, 15, 21]), rng)
+        with contextlib.redirect_stdout(io.StringIO()):
+            p = nyt.data_to_puz(data)
+        # An answer latin1ify can't handle ends up as more than one letter,
+        # and the file can't be read back, skip those
+        if len(p.solution) == p.width * p.height:
+            break
+    roll = rng.random()
+    if roll < 0.2:
+        p.title, p.notes = "", ""
+    elif roll < 0.4:
+        p.version, p.fileversion = b"1.2", b"1.2\0"
+    elif roll < 0.6 and p.solution.isascii():
+        # The grid has to be one byte a square in UTF-8 too
+        p.version, p.fileversion, p.encoding = b"2.0", b"2.0\0", puz.ENCODING_UTF8
+        p.title += " ☃"
+    if rng.random() < 0.2:
+        p.clues[rng.randrange(len(p.clues))] = ""
+    return p
+
+@cmd("cksum_diff", 2, "<count> <seed> = Compare the puz checksums with the original on random puzzles")
+def cksum_diff(count, seed):
+    import puz, random, struct
+    rng = random.Random(int(seed))
+    for _ in range(int(count)):
+        p = make_test_puz(rng)
+        data = p.tobytes()
+        cksum_gbl, _, cksum_hdr, cksum_magic = struct.unpack_from("<H11sxHQ", data, len(p.preamble))
+        if (cksum_gbl, cksum_hdr, cksum_magic) != reference_cksums(p):
+            print(f"ERROR: Different checksums for {p.title!r}")
+            exit(1)
+        for ext in p.extensions.values():
+            if puz.data_cksum(ext) != reference_data_cksum(ext):
+                print(f"ERROR: Different extension checksum for {p.title!r}")
+                exit(1)
+        if puz.load(data).tobytes() != data:
+            print(f"ERROR: {p.title!r} didn't load back the same")
+            exit(1)
+        # Flip a byte in the solution, loading it should fail now
+        pos = data.index(puz.ACROSSDOWN) - 2 + struct.calcsize(puz.HEADER_FORMAT)
+        try:
+            puz.load(data[:pos] + bytes([data[pos] ^ 1]) + data[pos + 1:])
+            print(f"ERROR: {p.title!r} loaded with a bad checksum")
+            exit(1)
+        except puz.PuzzleFormatError:
+            pass
+    print(f"Checked {int(count):,} puzzles, all matched")
+
+@cmd("cksum_bench", 1, "<count> = Time the puz checksums, tobytes, and load for a few grid sizes")
+def cksum_bench(count):
+    import puz
+    count = int(count)
+    for desc, size in (("15x15", 15), ("21x21", 21), ("Oversized 75x75", 75)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            p = nyt.data_to_puz(make_test_puzzle(size))
+        data = p.tobytes()
+        times = []
+        # The first checksum builds a table, leave that out of the times
+        puz.data_cksum(b"")
+        for func, value in ((reference_cksums, p), (puz.Puzzle.cksums, p), (puz.Puzzle.tobytes, p), (puz.load, data)):
+            start = time.perf_counter()
+            for _ in range(count):
+                func(value)
+            times.append((time.perf_counter() - start) / count * 1000)
+        print(f"{desc}:")
+        print(f"  Original checksums: {times[0]:.3f}ms, Shared: {times[1]:.3f}ms, {times[0] / times[1]:.2f}x")
+        print(f"  tobytes: {times[2]:.3f}ms, load: {times[3]:.3f}ms")
+
+@cmd("cache_check", 1, "<count> = Fill a response cache, measure what it writes, and check it survives being stopped")
+def cache_check(count):
+    import cache, json, tempfile
+    count = int(count)
+    value = "x" * 2000
+    written = {"entries": 0, "index": 0}
+    atomic_write = cache.atomic_write
+    def counting_write(filename, data):
+        written["index" if filename.endswith(cache.INDEX_NAME) else "entries"] += len(data)
+        atomic_write(filename, data)
+    cache.atomic_write = counting_write
+
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        c = cache.ResponseCache(root)
+        for i in range(count):
+            c.put(f"key{i}", value)
+        took = time.perf_counter() - start
+        journal = os.path.getsize(os.path.join(root, cache.JOURNAL_NAME))
+        print(f"{count:,} puts in {took:.3f}s: {written['entries']:,} bytes of entries, {journal:,} bytes of journal, {written['index']:,} bytes of index")
+
+        # Stop without flushing, and leave behind an entry the journal never
+        # heard about, and half a line of journal
+        orphan = c._entry_filename(cache.key_hash("orphan"))
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        with open(orphan, "wt") as f:
+            f.write(json.dumps({"key": "orphan", "value": value}))
+        with open(os.path.join(root, cache.JOURNAL_NAME), "at") as f:
+            f.write('["put", "')
+        c._journal.close()
+
+        c = cache.ResponseCache(root)
+        if len(c) != count or any(c.get(f"key{i}") != value for i in range(count)):
+            print("ERROR: Entries lost after stopping without a flush")
+            exit(1)
+        if os.path.isfile(orphan) or "orphan" in c:
+            print("ERROR: An orphaned entry was left behind")
+            exit(1)
+        c.flush()
+        if os.path.isfile(os.path.join(root, cache.JOURNAL_NAME)):
+            print("ERROR: The journal is still there after a flush")
+            exit(1)
+
+        # Shrink the limits, and make sure it's evicted down to them
+        c = cache.ResponseCache(root, max_entries=count // 2)
+        c.put("one_more", value)
+        c.flush()
+        c = cache.ResponseCache(root)
+        files = sum(len(x[2]) for x in os.walk(root)) - 1
+        if len(c) != count // 2 or files != len(c) or c.get("one_more") != value:
+            print(f"ERROR: Expected {count // 2:,} entries after evicting, found {len(c):,}, and {files:,} files")
+            exit(1)
+    cache.atomic_write = atomic_write
+    print("All checks passed")
+
+def import_times(modules):
+    # Import some modules in a fresh interpreter, returns how long each took in
+    # milliseconds, according to "python -X importtime", and the heavy modules
+    # that ended up imported along the way
+    code = f"import sys, {', '.join(modules)}; print(','.join(x for x in {HEAVY_MODULES!r} if x in sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and not line.endswith("imported package"):
+            _, cumulative, name = line[12:].split("|")
+            # Only count modules imported at the top level, the rest are
+            # included in those
+            if not name.startswith("  "):
+                times[name.strip()] = int(cumulative) / 1000
+    heavy = [x for x in proc.stdout.strip().split(",") if len(x) > 0]
+    return times, heavy
+
+@cmd("startup", 1, "<budget_ms> = Make sure importing nyt and get_range stays under a time budget")
+def startup(budget_ms):
+    modules = ["nyt", "get_range"]
+    # Take the best of a few runs, to keep noise out of it
+    best = None
+    for _ in range(5):
+        times, heavy = import_times(modules)
+        took = sum(times.get(x, 0) for x in modules)
+        if best is None or took < best:
+            best = took
+    for name in modules:
+        print(f"  {name}: {times.get(name, 0):.1f}ms")
+    print(f"Imports took {best:.1f}ms, budget is {float(budget_ms):.1f}ms")
+
+    ok = True
+    if len(heavy) > 0:
+        print(f"ERROR: Imported at startup: {', '.join(heavy)}")
+        ok = False
+    if best > float(budget_ms):
+        print("ERROR: Over budget")
+        ok = False
+    if not ok:
+        exit(1)
+
+def main():
+    args = sys.argv[1:]
+    for cur in _commands:
+        if len(args) == cur['args'] + 1 and args[0] == cur['cmd']:
+            cur['func'](*args[1:])
+            exit(0)
+
+    print("Usage:")
+    _commands.sort(key=lambda x: x['cmd'])
+    for cur in _commands:
+        print(f"  {cur['cmd']} {cur['desc']}")
+
+if __name__ == "__main__":
+    main()